@@ -0,0 +1,61 @@
+"""
+  Microbenchmark for ConfessionData.check_spam
+  Compares the original per-flag re.match loop against SpamFilter
+  Usage: python3 benchmarks/spam_flags.py
+"""
+
+import os, random, re, string, sys, timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from extensions.confessions_filters import SpamFilter # noqa: E402
+
+MESSAGES = 1000
+FLAGS = 50
+REPEAT = 5
+
+random.seed(0)
+domains = [''.join(random.choices(string.ascii_lowercase, k=8)) for _ in range(FLAGS - 2)]
+flags = [r'discord\.gg\/.+', r'^\s+$'] + [
+  rf'(?:https?://)?{domain}\.(?:com|net|xyz)/.*' for domain in domains
+]
+source = '\n'.join(flags)
+words = ['hello', 'anonymous', 'confession', 'server', 'today', 'really', 'think', 'discord']
+messages = [
+  ' '.join(random.choices(words, k=random.randint(3, 60))) for _ in range(MESSAGES)
+]
+# A handful of messages should actually be caught
+for i in range(0, MESSAGES, 100):
+  messages[i] = 'discord.gg/' + messages[i]
+
+
+def original():
+  """ The loop check_spam used before SpamFilter """
+  blocked = 0
+  for content in messages:
+    for spamflag in source.splitlines():
+      if content and re.match(spamflag, content):
+        blocked += 1
+        break
+  return blocked
+
+
+spamfilter = SpamFilter(source)
+
+
+def compiled():
+  blocked = 0
+  for content in messages:
+    spamfilter.update(source)
+    if content and spamfilter.match(content):
+      blocked += 1
+  return blocked
+
+
+if __name__ == '__main__':
+  assert original() == compiled()
+  before = min(timeit.repeat(original, number=1, repeat=REPEAT))
+  after = min(timeit.repeat(compiled, number=1, repeat=REPEAT))
+  print(f"{MESSAGES} messages x {FLAGS} spam flags (best of {REPEAT})")
+  print(f"  re.match loop: {before*1000:8.2f}ms")
+  print(f"  SpamFilter:    {after*1000:8.2f}ms")
+  print(f"  speedup:       {before/after:8.1f}x")
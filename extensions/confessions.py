@@ -8,17 +8,23 @@
 
 from __future__ import annotations
 
-import time
+import asyncio, time
+from collections import deque
 from base64 import b64encode
 from typing import Optional, Union, TYPE_CHECKING, cast
 import discord
 from discord import app_commands
-from discord.ext import commands, tasks
+from discord.ext import commands
 
 from .confessions_common import (
   ConfessionCog, Confessable, ChannelType, ChannelSelectView, ConfessionData, NoMemberCacheError,
-  Crypto, get_guildchannels, safe_fetch_target
+  Crypto, ScanCandidate, anonid_cache, channel_registry, scan_cache, spam_filter, webhook_cache,
+  send_queue, mutual_guilds, thread_index, rate_limiter, interaction_router, get_guildchannels,
+  safe_fetch_target
 )
+from .confessions_storage import close_guildstore
+from .confessions_filters import SearchIndex
+from .confessions_images import ImageFetcher
 
 if TYPE_CHECKING:
   from main import MerelyBot
@@ -28,17 +34,25 @@ if TYPE_CHECKING:
 class Confessions(ConfessionCog):
   """ Facilitates anonymous messaging with moderation on your server """
   SCOPE = 'confessions'
+  ALIAS_SYNC_DELAY = 5.0
+  ALIAS_SYNC_BUDGET = 5
+  ALIAS_SYNC_PERIOD = 60.0
+  STATS_PERIOD = 600.0
   customcommands: dict[int, str] = {}
 
   def __init__(self, bot:MerelyBot):
     self.bot = bot
     self.crypto = Crypto()
+    self.image_fetcher = ImageFetcher()
 
     # ensure config file has required data
     if not bot.config.has_section(self.SCOPE):
       bot.config.add_section(self.SCOPE)
-    if 'confession_cooldown' not in self.config:
-      self.config['confession_cooldown'] = '1'
+    if 'ratelimit_user' not in self.config:
+      # Carry over the old cooldown, which allowed one message every confession_cooldown seconds
+      self.config['ratelimit_user'] = '1/' + self.config.pop('confession_cooldown', '1')
+    if 'ratelimit_guild' not in self.config:
+      self.config['ratelimit_guild'] = '0'
     if 'report_channel' not in self.config:
       self.config['report_channel'] = ''
     if 'secret' not in self.config or self.config['secret'] == '':
@@ -51,6 +65,32 @@ class Confessions(ConfessionCog):
       self.config['spam_flags'] = ''
     if 'dm_notifications' not in self.config:
       self.config['dm_notifications'] = ''
+    if 'database' not in self.config:
+      self.config['database'] = ''
+    if 'save_delay' not in self.config:
+      self.config['save_delay'] = '5'
+    if 'reference_database' not in self.config:
+      self.config['reference_database'] = 'references.db'
+    if 'reference_limit' not in self.config:
+      self.config['reference_limit'] = '1000'
+    if 'reference_ttl' not in self.config:
+      self.config['reference_ttl'] = '7'
+    if 'image_cache' not in self.config:
+      self.config['image_cache'] = 'image_cache'
+    if 'image_cache_size' not in self.config:
+      self.config['image_cache_size'] = '256'
+    if 'image_cache_ttl' not in self.config:
+      self.config['image_cache_ttl'] = '7'
+    if 'webhook_pool_size' not in self.config:
+      self.config['webhook_pool_size'] = '1'
+    if 'send_queue_depth' not in self.config:
+      self.config['send_queue_depth'] = '20'
+    if 'send_queue_notify' not in self.config:
+      self.config['send_queue_notify'] = '3'
+    if 'digest_window' not in self.config:
+      self.config['digest_window'] = '10'
+    if 'archived_threads' not in self.config:
+      self.config['archived_threads'] = '0'
 
     if not bot.config.getboolean('extensions', 'confessions_setup', fallback=False):
       if not bot.quiet:
@@ -60,7 +100,11 @@ class Confessions(ConfessionCog):
         print(" - WARN: Without `confessions_moderation` enabled, vetting channels won't work")
 
     self.crypto.setkey(self.config['secret'])
-    self.confession_cooldown = dict()
+    channel_registry.load(self.store)
+    spam_filter.update(self.config['spam_flags'])
+    send_queue.maxdepth = self.config.getint('send_queue_depth')
+    # Vetting buttons only reach this if confessions_moderation isn't loaded to handle them
+    interaction_router.register('pendingconfession_', self.on_confession_review, fallback=True)
 
     # Add confession reply option to context menu
     self.confess_reply = app_commands.ContextMenu(
@@ -89,51 +133,131 @@ class Confessions(ConfessionCog):
       )
     )
 
-    # Initialize regular task to bind custom /confess aliases
-    self.bind_command_aliases.start()
+    # Restore custom /confess aliases which have already been synced, and queue any changes
+    self.alias_queue:set[int] = set()
+    self.alias_syncs:deque[float] = deque()
+    self.alias_task:asyncio.Task | None = None
+    for guild_id, customname in self.store.items('confessname_synced'):
+      self.bind_command_alias(discord.Object(guild_id), customname)
+      if customname != self.store.get(guild_id, 'confessname'):
+        self.queue_command_alias(guild_id)
+    for guild_id, customname in self.store.items('confessname'):
+      if customname and guild_id not in self.customcommands:
+        self.queue_command_alias(guild_id)
+
+    self.mutual_task:asyncio.Task | None = None
+    self.archive_tasks:dict[int, asyncio.Task] = {}
+    self.stats_task:asyncio.Task | None = None
+    if bot.verbose:
+      self.stats_task = self.bot.loop.create_task(self.log_stats())
 
   async def cog_unload(self):
-    self.bind_command_aliases.stop()
+    if self.alias_task:
+      self.alias_task.cancel()
+    if self.stats_task:
+      self.stats_task.cancel()
+    if self.mutual_task:
+      self.mutual_task.cancel()
+    for task in self.archive_tasks.values():
+      task.cancel()
+    self.archive_tasks.clear()
     self.bot.tree.remove_command(self.confess_reply.qualified_name, type=self.confess_reply.type)
     for guild_id, cmdname in self.customcommands.items():
       self.bot.tree.remove_command(cmdname, guild=discord.Object(guild_id))
+    self.customcommands.clear()
+    interaction_router.unregister('pendingconfession_', self.on_confession_review)
+    await send_queue.close()
+    await close_guildstore()
+    await self.image_fetcher.close()
+
+  async def log_stats(self):
+    """ Print counters from the confessions caches and queues every STATS_PERIOD, in verbose mode """
+    while True:
+      await asyncio.sleep(self.STATS_PERIOD)
+      stats:dict[str, dict[str, float]] = {
+        'config saves': self.store.saver.stats(),
+        'anon-ids': anonid_cache.stats(),
+        'send queue': send_queue.stats(),
+        'rate limits': rate_limiter.stats()
+      }
+      if mutual_guilds.built:
+        stats['mutual guilds'] = mutual_guilds.stats()
+      if moderation := self.bot.cogs.get('ConfessionsModeration'):
+        stats['vetting locks'] = cast("ConfessionsModeration", moderation).button_lock.stats()
+      for prefix, values in interaction_router.stats().items():
+        if values['calls']:
+          stats[f'route {prefix}'] = values
+      for name, values in stats.items():
+        print(f"Confessions {name}:", ', '.join(f'{k}={v:g}' for k, v in values.items()))
+
+  def queue_command_alias(self, guild_id:int):
+    """ Check a guild's custom name for /confess soon, along with any other queued guilds """
+    self.alias_queue.add(guild_id)
+    if self.alias_task is None or self.alias_task.done():
+      self.alias_task = self.bot.loop.create_task(self.bind_command_aliases())
 
-  @tasks.loop(seconds=10)
   async def bind_command_aliases(self):
-    """ If any users have requested a custom name for /confess, bind it to the tree """
-    for guild in self.bot.guilds:
-      customname = self.config.get(f'{guild.id}_confessname')
-      if customname:
-        if guild.id in self.customcommands:
-          # Check if custom command already exists
-          if self.customcommands[guild.id] == customname:
-            # No need to rebind unless the name changes
-            continue
-          self.bot.tree.remove_command(self.customcommands[guild.id], guild=guild)
-        self.customcommands[guild.id] = customname
-        self.bot.tree.add_command(
-          app_commands.Command(
-            name=customname,
-            description=app_commands.locale_str('confess_desc', scope=self.SCOPE),
-            callback=self.renamed_confess_callback,
-            guild_ids=[guild.id],
-            allowed_contexts=app_commands.AppCommandContext(guild=True)
-          )
-        )
+    """
+      If any users have requested a custom name for /confess, bind it to the tree
+      Changes are collected for ALIAS_SYNC_DELAY seconds, then synced within ALIAS_SYNC_BUDGET
+    """
+    await self.bot.wait_until_ready()
+    await asyncio.sleep(self.ALIAS_SYNC_DELAY)
+    while self.alias_queue:
+      guild = self.bot.get_guild(self.alias_queue.pop())
+      if guild is None:
+        continue
+      customname = self.store.get(guild.id, 'confessname') or None
+      if customname == self.store.get(guild.id, 'confessname_synced'):
+        continue
+      self.bind_command_alias(guild, customname)
+
+      # Spread out syncs so restarts and bursts of changes don't hit the rate limit
+      expiry = time.monotonic() - self.ALIAS_SYNC_PERIOD
+      while self.alias_syncs and self.alias_syncs[0] < expiry:
+        self.alias_syncs.popleft()
+      if len(self.alias_syncs) >= self.ALIAS_SYNC_BUDGET:
+        await asyncio.sleep(self.alias_syncs[0] - expiry)
+        self.alias_syncs.popleft()
+      self.alias_syncs.append(time.monotonic())
+      try:
         await self.bot.tree.sync(guild=guild)
-        #if self.bot.verbose:
-        print(f"Bound custom command /{customname} to guild {guild.name}")
+      except discord.HTTPException as e:
+        print(f"Failed to sync custom command /{customname} to guild {guild.name};", e)
+        continue
+
+      if customname:
+        self.store.set(guild.id, 'confessname_synced', customname)
+        if self.bot.verbose:
+          print(f"Bound custom command /{customname} to guild {guild.name}")
       else:
-        # Remove custom command if it exists
-        if guild.id in self.customcommands:
-          self.bot.tree.remove_command(self.customcommands[guild.id], guild=guild)
-          await self.bot.tree.sync(guild=guild)
+        self.store.pop(guild.id, 'confessname_synced')
+      self.store.save()
+
+  def bind_command_alias(self, guild:discord.abc.Snowflake, customname:str | None):
+    """ Add, rename or remove the custom /confess command for a guild in the local tree """
+    if guild.id in self.customcommands:
+      if self.customcommands[guild.id] == customname:
+        return
+      self.bot.tree.remove_command(self.customcommands.pop(guild.id), guild=guild)
+    if customname:
+      self.customcommands[guild.id] = customname
+      self.bot.tree.add_command(
+        app_commands.Command(
+          name=customname,
+          description=app_commands.locale_str('confess_desc', scope=self.SCOPE),
+          callback=self.renamed_confess_callback,
+          guild_ids=[guild.id],
+          allowed_contexts=app_commands.AppCommandContext(guild=True)
+        )
+      )
 
   # Context menu commands
 
-  @commands.cooldown(1, 1, type=commands.BucketType.user)
   async def confess_reply_callback(self, inter:discord.Interaction, message:discord.Message):
     """ Start a confession in this channel replying to this message """
+    if await self.check_ratelimit(inter):
+      return
     if message.is_system():
       await inter.response.send_message(self.babel(inter, 'confession_reply_failed'), ephemeral=True)
       return
@@ -146,7 +270,6 @@ class Confessions(ConfessionCog):
     content=app_commands.locale_str('confess_content_desc', scope=SCOPE),
     image=app_commands.locale_str('confess_image_desc', scope=SCOPE)
   )
-  @commands.cooldown(1, 1, type=commands.BucketType.user)
   async def renamed_confess_callback(
     self,
     inter:discord.Interaction,
@@ -156,6 +279,8 @@ class Confessions(ConfessionCog):
     """
       Send an anonymous message to this channel
     """
+    if await self.check_ratelimit(inter):
+      return
     assert isinstance(inter.channel, (discord.TextChannel, discord.Thread))
     pendingconfession = ConfessionData(self)
     pendingconfession.create(author=inter.user, target=inter.channel)
@@ -191,48 +316,62 @@ class Confessions(ConfessionCog):
     self, member:discord.Member
   ) -> tuple[list[tuple[Confessable, ChannelType]], bool]:
     """ Scans a guild for any targets that a member can use for confessions """
-
-    matches:list[tuple[Confessable, ChannelType]] = []
+    guild = member.guild
+    if guild.id not in scan_cache.candidates:
+      scan_cache.candidates[guild.id] = self.scancandidates(guild)
+    key = scan_cache.key(member)
+    if (result := scan_cache.get(guild.id, key)) is None:
+      candidates, vetting, _ = scan_cache.candidates[guild.id]
+      matches:list[tuple[Confessable, ChannelType]] = []
+      for channel, channeltype, threads in candidates:
+        if 'feedback' in channeltype.name or channel.permissions_for(member).read_messages:
+          matches += [(channel, channeltype)] + threads
+      result = (matches, vetting)
+      scan_cache.put(guild.id, key, result)
+
+    return list(result[0]), result[1]
+
+  def scancandidates(self, guild:discord.Guild) -> tuple[list[ScanCandidate], bool, set[int]]:
+    """
+      Finds every anonymous channel in a guild and its threads, sorted by position
+      Also returns whether there's a vetting channel and who has member-specific overwrites
+    """
+    candidates:list[ScanCandidate] = []
     vetting = False
-    guildchannels = get_guildchannels(self.config, member.guild.id)
-    for channel in member.guild.channels:
+    overwrites:set[int] = set()
+    guildchannels = get_guildchannels(self.config, guild.id)
+    for channel in guild.channels:
       if channel.id in guildchannels:
         assert isinstance(channel, discord.TextChannel)
         channeltype = guildchannels[channel.id]
         if channeltype == ChannelType.vetting:
           vetting = True
           continue
-        if 'feedback' in channeltype.name:
-          matches += [(channel, channeltype)] + self.scanchannel(channel, channeltype)
-          continue
-        if channel.permissions_for(member).read_messages:
-          matches += [(channel, channeltype)] + self.scanchannel(channel, channeltype)
-          continue
+        overwrites.update(t.id for t in channel.overwrites if not isinstance(t, discord.Role))
+        candidates.append((channel, channeltype, self.scanchannel(channel, channeltype)))
 
-    def sort(t:tuple[Confessable, ChannelType]):
+    def sort(t:ScanCandidate):
       channel = t[0]
-      if isinstance(channel, discord.TextChannel):
-        return (channel.category.position if channel.category else 0, channel.position)
-      elif isinstance(channel, discord.Thread):
-        assert channel.parent is not None
-        return (channel.category.position if channel.category else 0, channel.parent.position)
-      raise Exception("Confessable target was not a TextChannel or a Thread!")
-    matches.sort(key=sort)
+      return (channel.category.position if channel.category else 0, channel.position)
+    candidates.sort(key=sort)
 
-    return matches, vetting
+    return candidates, vetting, overwrites
 
   def scanchannel(
     self, channel:discord.TextChannel, channeltype:ChannelType
   ) -> list[tuple[Confessable, ChannelType]]:
     """ Scans a channel for any active threads that can be used for confessions """
-
-    matches:list[tuple[Confessable, ChannelType]] = []
-    for thread in channel.threads:
-      if thread.type != discord.ChannelType.public_thread:
-        continue
-      matches.append((thread, channeltype))
-
-    return matches
+    limit = self.config.getint('archived_threads', fallback=0)
+    if limit and thread_index.needs_archived(channel.id) and channel.id not in self.archive_tasks:
+      task = self.bot.loop.create_task(self.fetch_archived(channel, limit))
+      self.archive_tasks[channel.id] = task
+      task.add_done_callback(lambda _: self.archive_tasks.pop(channel.id, None))
+    return [(thread, channeltype) for thread in thread_index.threads(channel)]
+
+  async def fetch_archived(self, channel:discord.TextChannel, limit:int):
+    """ Add recently archived threads to the thread index, then rescan the guild """
+    await thread_index.fetch_archived(channel, limit)
+    scan_cache.forget(channel.guild.id)
 
   def listavailablechannels(
       self,
@@ -250,7 +389,15 @@ class Confessions(ConfessionCog):
         raise NoMemberCacheError()
       matches = []
       vetting = False
-      for guild in self.bot.guilds:
+      if not mutual_guilds.tracking and self.bot.is_ready():
+        # The cog was loaded after on_ready
+        self.build_mutual_guilds()
+      if mutual_guilds.built:
+        guilds = [g for i in sorted(mutual_guilds.get(user.id)) if (g := self.bot.get_guild(i))]
+      else:
+        # The member cache is still being filled, so the index would be incomplete
+        guilds = self.bot.guilds
+      for guild in guilds:
         if member := guild.get_member(user.id):
           newmatches, newvetting = self.scanguild(member)
           matches += newmatches
@@ -323,7 +470,8 @@ class Confessions(ConfessionCog):
       self.add_item(self.content)
 
       self.image = None
-      image_support = parent.config.getboolean(f"{origin.guild_id}_imagesupport", fallback=True)
+      assert origin.guild_id is not None
+      image_support = parent.store.getboolean(origin.guild_id, 'imagesupport', fallback=True)
       if data.attachment is None and image_support:
         self.image = discord.ui.FileUpload(
           custom_id='image',
@@ -349,27 +497,122 @@ class Confessions(ConfessionCog):
   #	Events
 
   @commands.Cog.listener('on_interaction')
-  async def on_confession_review(self, inter:discord.Interaction):
-    """ Notify users when handling vetting is not possible """
-    if inter.type != discord.InteractionType.component:
-      return
-    assert inter.data is not None and 'custom_id' in inter.data
+  async def route_interaction(self, inter:discord.Interaction):
+    """ Pass component interactions to the handler registered for their custom_id """
+    # Custom names for /confess are changed in /controlpanel, so check after admins use it
     if (
-      inter.data['custom_id'].startswith('pendingconfession_') and
-      'ConfessionsModeration' not in self.bot.cogs
+      inter.guild_id and inter.permissions.administrator and
+      inter.type in (discord.InteractionType.component, discord.InteractionType.modal_submit)
     ):
-      await inter.response.send_message(self.babel(inter, 'no_moderation'))
+      self.queue_command_alias(inter.guild_id)
+    await interaction_router.dispatch(inter)
+
+  async def on_confession_review(self, inter:discord.Interaction):
+    """ Notify users when handling vetting is not possible """
+    await inter.response.send_message(self.babel(inter, 'no_moderation'))
+
+  @commands.Cog.listener('on_webhooks_update')
+  async def webhook_changed(self, channel:discord.abc.GuildChannel):
+    """ Forget the cached webhook for a channel, it may have been edited or deleted """
+    webhook_cache.forget(channel.id)
+
+  @commands.Cog.listener('on_guild_channel_delete')
+  async def webhook_channel_delete(self, channel:discord.abc.GuildChannel):
+    """ Forget the cached webhook and threads for a deleted channel """
+    webhook_cache.forget(channel.id)
+    thread_index.forget_channel(channel.id)
+
+  @commands.Cog.listener('on_guild_channel_create')
+  @commands.Cog.listener('on_guild_channel_delete')
+  @commands.Cog.listener('on_thread_create')
+  @commands.Cog.listener('on_thread_join')
+  @commands.Cog.listener('on_thread_remove')
+  @commands.Cog.listener('on_guild_role_create')
+  @commands.Cog.listener('on_guild_role_delete')
+  async def channels_changed(self, obj:discord.abc.GuildChannel | discord.Thread | discord.Role):
+    """ Rescan a guild when its channels, threads or roles change """
+    scan_cache.forget(obj.guild.id)
+
+  @commands.Cog.listener('on_thread_create')
+  @commands.Cog.listener('on_thread_join')
+  async def thread_created(self, thread:discord.Thread):
+    """ Keep the thread index up to date, including threads which were unarchived while uncached """
+    thread_index.add(thread)
+
+  @commands.Cog.listener('on_thread_update')
+  async def thread_updated(self, _, thread:discord.Thread):
+    """ Keep the thread index up to date, including when cached threads are archived or unarchived """
+    thread_index.add(thread)
+
+  @commands.Cog.listener('on_thread_remove')
+  async def thread_removed(self, thread:discord.Thread):
+    """ Forget threads the bot was removed from, as they can no longer be confessed in """
+    thread_index.remove(thread.id, thread.parent_id)
+
+  @commands.Cog.listener('on_raw_thread_delete')
+  async def thread_deleted(self, payload:discord.RawThreadDeleteEvent):
+    """ Keep the thread index up to date """
+    thread_index.remove(payload.thread_id, payload.parent_id)
+    scan_cache.forget(payload.guild_id)
+
+  @commands.Cog.listener('on_guild_channel_update')
+  @commands.Cog.listener('on_thread_update')
+  @commands.Cog.listener('on_guild_role_update')
+  @commands.Cog.listener('on_guild_update')
+  async def channels_updated(self, before, _):
+    """ Rescan a guild when a channel is moved or permissions change """
+    scan_cache.forget(before.id if isinstance(before, discord.Guild) else before.guild.id)
+
+  @commands.Cog.listener('on_guild_join')
+  async def confessname_guild_join(self, guild:discord.Guild):
+    """ Bind the custom name for /confess if a guild already has one """
+    if self.store.get(guild.id, 'confessname'):
+      self.queue_command_alias(guild.id)
+
+  @commands.Cog.listener('on_ready')
+  async def mutual_guild_build(self):
+    """ Index mutual guilds for DM confessions once the member cache is filled """
+    if self.bot.intents.members and not mutual_guilds.tracking:
+      self.build_mutual_guilds()
+
+  def build_mutual_guilds(self):
+    """ Start building the mutual guild index in the background """
+    if self.mutual_task is None or self.mutual_task.done():
+      self.mutual_task = self.bot.loop.create_task(mutual_guilds.build(list(self.bot.guilds)))
+
+  @commands.Cog.listener('on_member_join')
+  async def mutual_guild_join(self, member:discord.Member):
+    """ Keep the mutual guild index up to date for DM confessions """
+    if mutual_guilds.tracking:
+      mutual_guilds.add(member.guild.id, member.id)
+
+  @commands.Cog.listener('on_raw_member_remove')
+  async def mutual_guild_leave(self, payload:discord.RawMemberRemoveEvent):
+    """ Keep the mutual guild index up to date for DM confessions """
+    if mutual_guilds.tracking:
+      mutual_guilds.remove(payload.guild_id, payload.user.id)
+
+  @commands.Cog.listener('on_guild_join')
+  @commands.Cog.listener('on_guild_available')
+  async def mutual_guild_add(self, guild:discord.Guild):
+    """ Index the members of a new or returning guild """
+    if mutual_guilds.tracking:
+      mutual_guilds.add_guild(guild)
+
+  @commands.Cog.listener('on_guild_remove')
+  async def mutual_guild_remove(self, guild:discord.Guild):
+    """ Unindex the members and threads of a guild the bot has left """
+    if mutual_guilds.tracking:
+      mutual_guilds.remove_guild(guild)
+    thread_index.forget_guild(guild)
 
   @commands.Cog.listener('on_message')
   async def confession_request(self, msg:discord.Message):
     """ Handle plain DM messages as confessions """
     if isinstance(msg.channel, discord.DMChannel) and msg.author != self.bot.user:
-      if msg.author in self.confession_cooldown and\
-         self.confession_cooldown[msg.author] > time.time():
+      # Floods are dropped silently, replying would only add to them
+      if self.ratelimit(msg.author.id):
         return
-      else:
-        self.confession_cooldown[msg.author] = time.time() +\
-          int(self.config.get('confession_cooldown', fallback=1))
 
       if not self.bot.member_cache:
         await msg.reply(self.babel(msg, 'dmconfessiondisabled'))
@@ -402,7 +645,6 @@ class Confessions(ConfessionCog):
     content=app_commands.locale_str('confess_content_desc', scope=SCOPE),
     image=app_commands.locale_str('confess_image_desc', scope=SCOPE)
   )
-  @commands.cooldown(1, 1, type=commands.BucketType.user)
   async def confess(
     self,
     inter:discord.Interaction,
@@ -412,6 +654,8 @@ class Confessions(ConfessionCog):
     """
       Send an anonymous message to this channel
     """
+    if await self.check_ratelimit(inter):
+      return
     assert isinstance(inter.channel, (discord.TextChannel, discord.Thread))
     pendingconfession = ConfessionData(self)
     pendingconfession.create(author=inter.user, target=inter.channel)
@@ -431,7 +675,6 @@ class Confessions(ConfessionCog):
     content=app_commands.locale_str('confess_content_desc', scope=SCOPE),
     image=app_commands.locale_str('confess_image_desc', scope=SCOPE)
   )
-  @commands.cooldown(1, 1, type=commands.BucketType.user)
   async def confess_to(
     self,
     inter:discord.Interaction,
@@ -442,6 +685,8 @@ class Confessions(ConfessionCog):
     """
       Send an anonymous message to a specified channel
     """
+    if await self.check_ratelimit(inter):
+      return
     if channel.isdigit() and int(channel):
       if targetchannel := await safe_fetch_target(self, inter, int(channel)):
         pendingconfession = ConfessionData(self)
@@ -463,32 +708,37 @@ class Confessions(ConfessionCog):
         value='-1'
       )]
 
-    results = []
     matches, _ = self.scanguild(inter.user)
-    for match in matches:
-      if search in match[0].name:
-        name:str
-        if isinstance(match[0], discord.TextChannel):
-          name = self.bot.utilities.truncate(match[0].name, 40)
-        elif isinstance(match[0], discord.Thread):
-          assert match[0].parent is not None
-          name = (
-            self.bot.utilities.truncate(match[0].parent.name, 20) + '/'
-            + self.bot.utilities.truncate(match[0].name, 20)
-          )
-        else:
-          name = 'UNKNOWN TYPE'
-        results.append(
-          app_commands.Choice(
-            name=f"{match[1].icon} #{name}",
-            value=str(match[0].id)
-          )
-        )
-    return results[0:24] + (
+    available = set(match[0].id for match in matches)
+    guild = inter.user.guild
+    if guild.id not in scan_cache.search:
+      scan_cache.search[guild.id] = self.searchindex(guild)
+    results = scan_cache.search[guild.id].search(search, 26, lambda r: r[0] in available)
+    return [r[1] for r in results[0:24]] + (
       [app_commands.Choice(name=self.babel(inter, 'concat_list'), value='0')]
       if len(results) > 25 else []
     )
 
+  def searchindex(self, guild:discord.Guild) -> SearchIndex[tuple[int, app_commands.Choice[str]]]:
+    """ Index every anonymous channel and thread in a guild by name for autocomplete """
+    entries:list[tuple[tuple[int, app_commands.Choice[str]], str]] = []
+    candidates, _, _ = scan_cache.candidates[guild.id]
+    for channel, channeltype, threads in candidates:
+      for target, _ in [(channel, channeltype)] + threads:
+        if isinstance(target, discord.Thread):
+          assert target.parent is not None
+          searchname = target.parent.name + '/' + target.name
+          name = (
+            self.bot.utilities.truncate(target.parent.name, 20) + '/'
+            + self.bot.utilities.truncate(target.name, 20)
+          )
+        else:
+          searchname = target.name
+          name = self.bot.utilities.truncate(target.name, 40)
+        choice = app_commands.Choice(name=f"{channeltype.icon} #{name}", value=str(target.id))
+        entries.append(((target.id, choice), searchname))
+    return SearchIndex(entries)
+
   @app_commands.command(
     name=app_commands.locale_str('list', scope=SCOPE),
     description=app_commands.locale_str('list_desc', scope=SCOPE)
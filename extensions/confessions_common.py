@@ -5,22 +5,29 @@
 """
 from __future__ import annotations
 
-import io, re, secrets, hashlib
+import asyncio, math, re, secrets, hashlib, sys, time
 from base64 import b64encode, b64decode
 from Crypto.Cipher import AES
-from typing import Optional, Literal, Generator, Any, TYPE_CHECKING, cast
-from collections import OrderedDict
+from typing import (
+  Optional, Literal, Generator, AsyncIterator, Callable, Coroutine, Any, IO, TYPE_CHECKING, cast
+)
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
 import discord
 from discord.ext import commands
-import aiohttp
 
 from main import MerelyCog
+from .confessions_storage import GuildStore, get_guildstore
+from .confessions_filters import SpamFilter, BadwordCache, SearchIndex
+from .confessions_images import ImageDownloadError
 
 if TYPE_CHECKING:
   from collections.abc import Mapping
+  from main import MerelyBot
   from configparser import SectionProxy
   from babel import Babel, Resolvable
   from extensions.log import Log
+  from .confessions import Confessions
   from .confessions_moderation import ConfessionsModeration
 
 type Confessable = (discord.TextChannel | discord.Thread)
@@ -31,6 +38,37 @@ type Confessable = (discord.TextChannel | discord.Thread)
 class ConfessionCog(MerelyCog):
   crypto: Crypto
 
+  @property
+  def store(self) -> GuildStore:
+    """ Per-guild settings, which may be in config.ini or SQLite """
+    return get_guildstore(self.config)
+
+  def ratelimit(self, user_id:int, guild_id:Optional[int] = None) -> float:
+    """
+      Spend a send from the user's and guild's rate limits, returns the seconds to wait if either is empty
+      Guilds can set their own `ratelimit_guild`, and a stricter `ratelimit_user` for their members
+    """
+    limits = []
+    if limit := rate_limiter.parse(self.config.get('ratelimit_user')):
+      limits.append((('user', user_id, 0), limit))
+    if guild_id is not None:
+      if limit := rate_limiter.parse(self.store.get(guild_id, 'ratelimit_user')):
+        limits.append((('member', guild_id, user_id), limit))
+      if limit := rate_limiter.parse(
+        self.store.get(guild_id, 'ratelimit_guild', self.config.get('ratelimit_guild'))
+      ):
+        limits.append((('guild', guild_id, 0), limit))
+    return rate_limiter.acquire(limits) if limits else 0.0
+
+  async def check_ratelimit(self, inter:discord.Interaction) -> bool:
+    """ Turns the interaction away if the user or guild is sending too quickly, returns True if so """
+    if wait := self.ratelimit(inter.user.id, inter.guild_id):
+      await inter.response.send_message(
+        self.babel(inter, 'confession_ratelimited', seconds=math.ceil(wait)), ephemeral=True
+      )
+      return True
+    return False
+
   async def on_channeltype_send(
     self, inter:discord.Interaction, data:ConfessionData
   ) -> dict[str, Any] | Literal[False]:
@@ -192,19 +230,152 @@ def findvettingchannel(guildchannels:dict[int, ChannelType]) -> Optional[int]:
   return None
 
 
+class ChannelRegistry:
+  """
+    In-memory index of every guild's anonymous channels
+
+    Each `{guild_id}_channels` config string is parsed once and kept in memory, along with a
+    reverse index of channel_id -> (guild_id, channeltype) and each guild's vetting channel.
+    All changes must go through set_guildchannels() or forget() to keep this in sync.
+  """
+  _guilds:dict[int, dict[int, ChannelType]]
+  _channels:dict[int, tuple[int, ChannelType]]
+  _vetting:dict[int, int]
+  loaded:bool = False
+
+  def __init__(self):
+    self._guilds = {}
+    self._channels = {}
+    self._vetting = {}
+
+  def load(self, store:GuildStore):
+    """ Parse every guild's channels from storage, replacing anything in memory """
+    self._guilds.clear()
+    self._channels.clear()
+    self._vetting.clear()
+    scan_cache.clear()
+    for guild_id, value in store.items('channels'):
+      self.update(guild_id, {int(k):ChannelType.from_value(v) for k,v in (
+        e.split('=') for e in value.split(',') if e
+      )})
+    self.loaded = True
+
+  def update(self, guild_id:int, guildchannels:dict[int, ChannelType] | None):
+    """ Replace the channels stored for a guild and update the indexes """
+    self.forget(guild_id)
+    if not guildchannels:
+      return
+    self._guilds[guild_id] = guildchannels
+    for channel_id, channeltype in guildchannels.items():
+      self._channels[channel_id] = (guild_id, channeltype)
+      if channeltype == ChannelType.vetting:
+        self._vetting[guild_id] = channel_id
+
+  def forget(self, guild_id:int):
+    """ Remove a guild from all indexes """
+    for channel_id in self._guilds.pop(guild_id, {}):
+      self._channels.pop(channel_id, None)
+    self._vetting.pop(guild_id, None)
+    scan_cache.forget(guild_id)
+
+  def guild(self, guild_id:int) -> dict[int, ChannelType]:
+    """ Returns {channel_id: channel_type} for a guild, this must not be modified """
+    return self._guilds.get(guild_id, {})
+
+  def lookup(self, channel_id:int) -> tuple[int, ChannelType] | None:
+    """ Returns (guild_id, channel_type) for a channel, if it is set """
+    return self._channels.get(channel_id)
+
+  def vetting(self, guild_id:int) -> Optional[int]:
+    """ Returns the vetting channel of a guild, if it has one """
+    return self._vetting.get(guild_id)
+
+
+type ScanCandidate = tuple[discord.TextChannel, ChannelType, list[tuple[Confessable, ChannelType]]]
+
+
+class ScanCache:
+  """
+    Remembers which anonymous channels members of a guild can see
+
+    Each guild's anonymous channels and their threads are collected and sorted once. Results are
+    then kept for each combination of roles, since that's what decides permissions. Members with
+    their own permission overwrites, and guild owners, get results of their own.
+    Must be cleared for a guild whenever its channels, threads, roles or permissions change.
+  """
+  MAXKEYS = 256
+
+  def __init__(self):
+    self.candidates:dict[int, tuple[list[ScanCandidate], bool, set[int]]] = {}
+    self.results:dict[int, dict[tuple, tuple[list[tuple[Confessable, ChannelType]], bool]]] = {}
+    self.search:dict[int, SearchIndex[tuple[int, discord.app_commands.Choice[str]]]] = {}
+
+  def key(self, member:discord.Member) -> tuple:
+    """ Members who share a key are guaranteed to see the same channels """
+    _, _, overwrites = self.candidates.get(member.guild.id, (None, None, set()))
+    special = member.id in overwrites or member.id == member.guild.owner_id
+    return (member.id if special else 0, frozenset(role.id for role in member.roles))
+
+  def get(
+    self, guild_id:int, key:tuple
+  ) -> Optional[tuple[list[tuple[Confessable, ChannelType]], bool]]:
+    return self.results.get(guild_id, {}).get(key)
+
+  def put(self, guild_id:int, key:tuple, result:tuple[list[tuple[Confessable, ChannelType]], bool]):
+    results = self.results.setdefault(guild_id, {})
+    if len(results) >= self.MAXKEYS:
+      results.clear()
+    results[key] = result
+
+  def forget(self, guild_id:int):
+    self.candidates.pop(guild_id, None)
+    self.results.pop(guild_id, None)
+    self.search.pop(guild_id, None)
+
+  def clear(self):
+    self.candidates.clear()
+    self.results.clear()
+    self.search.clear()
+
+
+channel_registry = ChannelRegistry()
+scan_cache = ScanCache()
+
+
 def get_guildchannels(config:SectionProxy, guild_id:int) -> dict[int, ChannelType]:
-  """ Returns a dictionary of {channel_id: channel_type} for the provided guild """
-  return {int(k):ChannelType.from_value(v) for k,v in (
-    e.split('=') for e in config.get(f'{guild_id}_channels', fallback='').split(',') if e
-  )}
+  """
+    Returns a dictionary of {channel_id: channel_type} for the provided guild
+    This dictionary is shared, copy it before making changes
+  """
+  if not channel_registry.loaded:
+    channel_registry.load(get_guildstore(config))
+  return channel_registry.guild(guild_id)
+
+
+def get_channeltype(config:SectionProxy, channel_id:int) -> ChannelType:
+  """ Returns the channel_type of a channel, threads should provide their parent_id """
+  if not channel_registry.loaded:
+    channel_registry.load(get_guildstore(config))
+  if match := channel_registry.lookup(channel_id):
+    return match[1]
+  return ChannelType.unset
+
+
+def get_vettingchannel(config:SectionProxy, guild_id:int) -> Optional[int]:
+  """ Returns the id of the vetting channel for the provided guild, if there is one """
+  if not channel_registry.loaded:
+    channel_registry.load(get_guildstore(config))
+  return channel_registry.vetting(guild_id)
 
 
 def set_guildchannels(config:SectionProxy, guild_id:int, guildchannels:dict[int, ChannelType] | None):
-  """ Writes a dictionary of {channel_id: channel_type} to the config """
+  """ Writes a dictionary of {channel_id: channel_type} to storage """
+  store = get_guildstore(config)
   if guildchannels:
-    config[f'{guild_id}_channels'] = ','.join(f'{k}={int(v)}' for k,v in guildchannels.items())
+    store.set(guild_id, 'channels', ','.join(f'{k}={int(v)}' for k,v in guildchannels.items()))
   else:
-    config.pop(f'{guild_id}_channels')
+    store.pop(guild_id, 'channels')
+  channel_registry.update(guild_id, dict(guildchannels) if guildchannels else None)
 
 
 async def safe_fetch_target(
@@ -213,16 +384,12 @@ async def safe_fetch_target(
   channel_id:int
 ) -> Optional[Confessable]:
   """ Gracefully handles whenever a confession target isn't available """
-  try:
-    result = await parent.bot.fetch_channel(channel_id)
-    assert isinstance(result, discord.TextChannel)
-    return result
-  except discord.Forbidden | discord.HTTPException | discord.NotFound:
+  if (result := await resolver.target(parent.bot, channel_id, inter.guild)) is None:
     await inter.response.send_message(
       parent.babel(inter, 'missingchannelerr') + ' (fetch)',
       ephemeral=True
     )
-    return None
+  return result
 
 
 # Exceptions
@@ -310,12 +477,12 @@ class ChannelSelectView(discord.ui.View):
     assert isinstance(selectedchannel, discord.TextChannel)
     self.selection = selectedchannel
     self.update_list()
-    guildchannels = get_guildchannels(self.parent.config, self.selection.guild.id)
-    vetting = findvettingchannel(guildchannels)
-    channeltype = guildchannels.get(
+    vetting = get_vettingchannel(self.parent.config, self.selection.guild.id)
+    channeltype = get_channeltype(
+      self.parent.config,
       self.selection.parent_id if isinstance(self.selection, discord.Thread) else self.selection.id
     )
-    assert channeltype is not None
+    assert channeltype != ChannelType.unset
     await inter.response.edit_message(
       content=self.parent.babel(
         inter, 'channelprompted', channel=self.selection.mention,
@@ -485,7 +652,762 @@ class Crypto:
     return rawdata
 
 
-referenced_message_cache:OrderedDict[int, discord.Message | discord.PartialMessage] = OrderedDict()
+class AnonIdCache:
+  """
+    Keeps decoded guild salts in memory and memoizes recently calculated anon-ids
+    Must be cleared for a guild whenever that guild's salt changes
+  """
+  MAXSIZE = 10000
+  hits:int = 0
+  misses:int = 0
+
+  def __init__(self):
+    self.salts:dict[int, bytes] = {}
+    self.anonids:OrderedDict[tuple[int, int], str] = OrderedDict()
+
+  def get(self, guild_id:int, user_id:int) -> Optional[str]:
+    """ Returns a cached anon-id, marking it as recently used """
+    key = (guild_id, user_id)
+    if key in self.anonids:
+      self.hits += 1
+      self.anonids.move_to_end(key)
+      return self.anonids[key]
+    self.misses += 1
+    return None
+
+  def put(self, guild_id:int, user_id:int, anonid:str):
+    """ Store an anon-id, evicting the least recently used one if full """
+    self.anonids[(guild_id, user_id)] = anonid
+    if len(self.anonids) > self.MAXSIZE:
+      self.anonids.popitem(last=False)
+
+  def forget(self, guild_id:int):
+    """ Drop the salt and all anon-ids for a guild """
+    self.salts.pop(guild_id, None)
+    for key in [k for k in self.anonids if k[0] == guild_id]:
+      del self.anonids[key]
+
+  def stats(self) -> dict[str, int]:
+    """ Cache size and hit/miss counters for monitoring """
+    return {'size': len(self.anonids), 'salts': len(self.salts), 'hits': self.hits, 'misses': self.misses}
+
+
+class WebhookCache:
+  """
+    Remembers the bot's webhooks in each channel, so webhook sends don't need to look them up first
+    Entries must be dropped when a webhook is changed or deleted
+
+    Discord rate limits each webhook separately, so busy channels can be given a pool of up to
+    `poolsize` webhooks. Sends go to the webhook with the most headroom, estimated from its recent
+    sends, and another webhook is only created once every webhook in the pool is saturated.
+    Each channel's pool is only loaded or grown by one task at a time.
+  """
+  # Discord allows roughly 5 messages every 2 seconds per webhook
+  RATE_LIMIT = 5
+  RATE_WINDOW = 2.0
+
+  def __init__(self):
+    self.webhooks:dict[int, list[discord.Webhook]] = {}
+    self.recent:dict[int, deque[float]] = {}
+    self.locks:dict[int, asyncio.Lock] = {}
+
+  async def load(
+    self, bot:MerelyBot, channel:discord.TextChannel, poolsize:int = 1
+  ) -> list[discord.Webhook]:
+    """ Returns the pool for channel, creating its first webhook if needed. Raises discord.Forbidden """
+    async with self.locks.setdefault(channel.id, asyncio.Lock()):
+      return await self._load(bot, channel, poolsize)
+
+  async def _load(
+    self, bot:MerelyBot, channel:discord.TextChannel, poolsize:int
+  ) -> list[discord.Webhook]:
+    pool = self.webhooks.get(channel.id)
+    if pool is None:
+      pool = [w for w in await channel.webhooks() if w.user == bot.user][:max(poolsize, 1)]
+      self.webhooks[channel.id] = pool
+    if not pool:
+      pool.append(await channel.create_webhook(name=bot.config['main']['botname']))
+    return pool
+
+  async def fetch(
+    self, bot:MerelyBot, channel:discord.TextChannel, poolsize:int = 1
+  ) -> discord.Webhook:
+    """
+      Returns the least busy webhook in channel, growing the pool if needed. Raises discord.Forbidden
+      The send is recorded straight away, so concurrent sends are spread across the pool
+    """
+    async with self.locks.setdefault(channel.id, asyncio.Lock()):
+      pool = await self._load(bot, channel, poolsize)
+      # Ties go to the webhook which was used least recently, so idle pools are used round-robin
+      webhook = min(pool, key=lambda w: (-self.headroom(w), self.last_used(w)))
+      if self.headroom(webhook) <= 0 and len(pool) < poolsize:
+        webhook = await channel.create_webhook(name=bot.config['main']['botname'])
+        pool.append(webhook)
+      self.record(webhook)
+      return webhook
+
+  def headroom(self, webhook:discord.Webhook) -> int:
+    """ Estimated number of sends left in the current rate limit window """
+    recent = self.recent.get(webhook.id)
+    if not recent:
+      return self.RATE_LIMIT
+    expiry = time.monotonic() - self.RATE_WINDOW
+    while recent and recent[0] < expiry:
+      recent.popleft()
+    return self.RATE_LIMIT - len(recent)
+
+  def last_used(self, webhook:discord.Webhook) -> float:
+    recent = self.recent.get(webhook.id)
+    return recent[-1] if recent else 0.0
+
+  def record(self, webhook:discord.Webhook):
+    """ Note a send through webhook for rate limit estimates """
+    self.recent.setdefault(webhook.id, deque()).append(time.monotonic())
+
+  def discard(self, webhook:discord.Webhook):
+    """ Drop a webhook which no longer exists """
+    self.recent.pop(webhook.id, None)
+    if webhook.channel_id and (pool := self.webhooks.get(webhook.channel_id)):
+      if webhook in pool:
+        pool.remove(webhook)
+      if not pool:
+        del self.webhooks[webhook.channel_id]
+
+  def forget(self, channel_id:int):
+    self.locks.pop(channel_id, None)
+    for webhook in self.webhooks.pop(channel_id, []):
+      self.recent.pop(webhook.id, None)
+
+  def forget_guild(self, guild_id:int):
+    for channel_id in [c for c, p in self.webhooks.items() if p and p[0].guild_id == guild_id]:
+      self.forget(channel_id)
+
+
+class SendQueue:
+  """
+    Sends messages to each channel in order, a few at a time
+
+    A burst of confessions to one channel would otherwise all wait on the same rate limit at once.
+    Each busy channel gets workers which drain its queue and stop once the queue is empty. Sends
+    through the bot share one rate limit, so they get one worker, while webhook sends can have a
+    worker for each webhook in the pool. Queues are keyed by the channel which owns the rate limit,
+    so threads share their parent's queue. Queues are bounded, so a flood of messages is turned
+    away instead of piling up.
+  """
+  maxdepth:int = 20
+  sent:int = 0
+  total_wait:float = 0.0
+  max_wait:float = 0.0
+
+  def __init__(self):
+    self.queues:dict[int, deque[tuple[Coroutine, asyncio.Future, float]]] = {}
+    self.workers:dict[int, set[asyncio.Task]] = {}
+
+  def submit(self, channel_id:int, coro:Coroutine, concurrency:int = 1) -> asyncio.Future:
+    """
+      Queue a send, returns a future for its result. Raises asyncio.QueueFull
+      Up to concurrency sends to this channel can be in flight at once
+    """
+    queue = self.queues.setdefault(channel_id, deque())
+    if len(queue) >= self.maxdepth:
+      raise asyncio.QueueFull()
+    future = asyncio.get_running_loop().create_future()
+    queue.append((coro, future, time.monotonic()))
+    workers = self.workers.setdefault(channel_id, set())
+    if len(workers) < max(concurrency, 1):
+      workers.add(asyncio.create_task(self._work(channel_id)))
+    return future
+
+  async def _work(self, channel_id:int):
+    queue = self.queues[channel_id]
+    try:
+      while queue:
+        coro, future, queued = queue.popleft()
+        if future.done():
+          # The sender gave up waiting
+          coro.close()
+          continue
+        wait = time.monotonic() - queued
+        try:
+          result = await coro
+        except asyncio.CancelledError:
+          future.cancel()
+          raise
+        except Exception as e:
+          if not future.done():
+            future.set_exception(e)
+        else:
+          self.sent += 1
+          self.total_wait += wait
+          self.max_wait = max(self.max_wait, wait)
+          if not future.done():
+            future.set_result(result)
+    finally:
+      workers = self.workers[channel_id]
+      workers.discard(cast(asyncio.Task, asyncio.current_task()))
+      if not workers:
+        del self.workers[channel_id]
+        if not queue:
+          del self.queues[channel_id]
+
+  async def close(self):
+    """ Cancel every queued and in-flight send """
+    for queue in self.queues.values():
+      while queue:
+        coro, future, _ = queue.popleft()
+        coro.close()
+        future.cancel()
+    workers = [task for tasks in self.workers.values() for task in tasks]
+    for task in workers:
+      task.cancel()
+    await asyncio.gather(*workers, return_exceptions=True)
+    self.queues.clear()
+    self.workers.clear()
+
+  def depth(self, channel_id:int) -> int:
+    """ Number of sends waiting for a channel """
+    return len(self.queues.get(channel_id, ()))
+
+  def stats(self) -> dict[str, float]:
+    """ Queue depths and wait times for monitoring """
+    return {
+      'channels': len(self.queues),
+      'queued': sum(len(q) for q in self.queues.values()),
+      'deepest': max((len(q) for q in self.queues.values()), default=0),
+      'sent': self.sent,
+      'avg_wait': self.total_wait / self.sent if self.sent else 0.0,
+      'max_wait': self.max_wait
+    }
+
+
+class DigestBatcher:
+  """
+    Collects confessions for channels in digest mode and sends them together as one message
+
+    A digest is sent `window` seconds after its first confession arrives, or sooner if it reaches
+    Discord's limits of 10 embeds and 6000 characters per message.
+  """
+  MAX_EMBEDS = 10
+  MAX_LENGTH = 6000
+
+  def __init__(self):
+    self.batches:dict[int, list[tuple[discord.Embed, discord.File | None, asyncio.Future]]] = {}
+    self.timers:dict[int, asyncio.TimerHandle] = {}
+
+  def add(
+    self, target:Confessable, preface:str, embed:discord.Embed, file:discord.File | None, window:float
+  ) -> asyncio.Future:
+    """ Add a confession to the next digest for target, returns a future for the send """
+    batch = self.batches.get(target.id, [])
+    if batch and len(preface) + sum(len(e) for e, _, _ in batch) + len(embed) > self.MAX_LENGTH:
+      self.flush(target, preface)
+      batch = []
+    future = asyncio.get_running_loop().create_future()
+    batch.append((embed, file, future))
+    self.batches[target.id] = batch
+    if len(batch) >= self.MAX_EMBEDS:
+      self.flush(target, preface)
+    elif len(batch) == 1:
+      self.timers[target.id] = asyncio.get_running_loop().call_later(
+        window, self.flush, target, preface
+      )
+    return future
+
+  def flush(self, target:Confessable, preface:str):
+    """ Send the pending digest for target now """
+    if timer := self.timers.pop(target.id, None):
+      timer.cancel()
+    batch = self.batches.pop(target.id, [])
+    if not batch:
+      return
+    files = []
+    for i, (embed, file, _) in enumerate(batch):
+      if file:
+        # Every image needs a unique name within the message
+        file.filename = f'file{i}.' + file.filename.rsplit('.', 1)[-1]
+        embed.set_image(url='attachment://'+file.filename)
+        files.append(file)
+    futures = [f for _, _, f in batch]
+    try:
+      sent = send_queue.submit(
+        target.parent_id if isinstance(target, discord.Thread) else target.id,
+        target.send(preface, embeds=[e for e, _, _ in batch], files=files)
+      )
+    except asyncio.QueueFull as e:
+      for future in futures:
+        future.set_exception(e)
+      return
+
+    def resolve(sent:asyncio.Future):
+      for future in futures:
+        if future.done():
+          continue
+        if sent.exception():
+          future.set_exception(cast(BaseException, sent.exception()))
+        else:
+          future.set_result(sent.result())
+    sent.add_done_callback(resolve)
+
+
+class Resolver:
+  """
+    Finds channels and members in the gateway cache, only asking the API when they aren't there
+
+    API results are kept for `TTL` seconds. Channels and members which couldn't be fetched are
+    remembered for `MISSING_TTL` seconds, and the same error is raised again without a request.
+    Permission checks are kept for `PERMISSION_TTL` seconds.
+  """
+  TTL = 300
+  MISSING_TTL = 60
+  PERMISSION_TTL = 10
+  MAXSIZE = 10000
+
+  def __init__(self):
+    self.fetched:OrderedDict[tuple[int, int], tuple[float, Any]] = OrderedDict()
+    self.missing:OrderedDict[tuple[int, int], tuple[float, discord.HTTPException]] = OrderedDict()
+    self.permissions:OrderedDict[tuple[int, int], tuple[float, discord.Permissions]] = OrderedDict()
+
+  def _lookup(self, cache:OrderedDict, key:tuple[int, int]):
+    if (entry := cache.get(key)) is not None:
+      if entry[0] > time.monotonic():
+        return entry[1]
+      del cache[key]
+    return None
+
+  def _remember(self, cache:OrderedDict, key:tuple[int, int], ttl:float, value):
+    cache[key] = (time.monotonic() + ttl, value)
+    cache.move_to_end(key)
+    if len(cache) > self.MAXSIZE:
+      cache.popitem(last=False)
+
+  async def _fetch(self, key:tuple[int, int], coro:Coroutine):
+    """ Await an API request, remembering whether it failed """
+    if error := self._lookup(self.missing, key):
+      coro.close()
+      raise error
+    try:
+      result = await coro
+    except (discord.NotFound, discord.Forbidden) as e:
+      self._remember(self.missing, key, self.MISSING_TTL, e)
+      raise
+    self._remember(self.fetched, key, self.TTL, result)
+    return result
+
+  async def channel(
+    self, bot:MerelyBot, channel_id:int, guild:Optional[discord.Guild] = None
+  ) -> Confessable:
+    """
+      Returns a text channel or thread. Raises discord.NotFound or discord.Forbidden
+      Pass the guild if it's known, otherwise it's found from the channel registry
+    """
+    if guild is None and (registered := channel_registry.lookup(channel_id)):
+      guild = bot.get_guild(registered[0])
+    if guild is not None:
+      channel = guild.get_channel_or_thread(channel_id)
+    else:
+      # bot.get_channel searches every guild, so it's only used for unregistered threads
+      channel = bot.get_channel(channel_id)
+    if channel is None:
+      key = (0, channel_id)
+      channel = (
+        self._lookup(self.fetched, key) or await self._fetch(key, bot.fetch_channel(channel_id))
+      )
+    if not isinstance(channel, (discord.TextChannel, discord.Thread)):
+      raise TypeError("Channel", channel_id, "is not a text channel or thread")
+    return channel
+
+  async def member(self, guild:discord.Guild, user_id:int) -> discord.Member:
+    """ Returns a member of guild. Raises discord.NotFound or discord.Forbidden """
+    if member := guild.get_member(user_id):
+      return member
+    key = (guild.id, user_id)
+    return self._lookup(self.fetched, key) or await self._fetch(key, guild.fetch_member(user_id))
+
+  async def target(
+    self, bot:MerelyBot, channel_id:int, guild:Optional[discord.Guild] = None
+  ) -> Optional[Confessable]:
+    """ Returns a channel or thread the bot can see, or None if it's unavailable """
+    try:
+      channel = await self.channel(bot, channel_id, guild)
+    except (discord.HTTPException, TypeError):
+      return None
+    if not self.permissions_for(channel, channel.guild.me).view_channel:
+      return None
+    return channel
+
+  def permissions_for(self, channel:Confessable, member:discord.Member) -> discord.Permissions:
+    """ Returns the permissions member has in channel """
+    key = (channel.id, member.id)
+    if (permissions := self._lookup(self.permissions, key)) is None:
+      permissions = channel.permissions_for(member)
+      self._remember(self.permissions, key, self.PERMISSION_TTL, permissions)
+    return permissions
+
+  def forget(self, guild_id:int, object_id:int):
+    """ Drop anything cached about a channel (guild_id=0) or member """
+    self.fetched.pop((guild_id, object_id), None)
+    self.missing.pop((guild_id, object_id), None)
+
+
+class MutualGuildIndex:
+  """
+    Index of user_id -> ids of the guilds they share with the bot, for finding DM confession targets
+
+    Built from the member cache once the bot is ready, then kept up to date with member and guild
+    events. Stale entries are harmless, as callers still confirm membership with guild.get_member.
+    Members are indexed in chunks which yield to the event loop, so building never stalls the bot.
+  """
+  CHUNK_SIZE = 10000
+  built:bool = False
+  building:bool = False
+
+  def __init__(self):
+    self.users:dict[int, set[int]] = {}
+
+  async def build(self, guilds:list[discord.Guild]):
+    """ Index every cached member of every guild, events should be applied while this runs """
+    self.users.clear()
+    self.building = True
+    try:
+      count = 0
+      for guild in guilds:
+        for member in list(guild.members):
+          self.users.setdefault(member.id, set()).add(guild.id)
+          count += 1
+          if count % self.CHUNK_SIZE == 0:
+            await asyncio.sleep(0)
+      self.built = True
+    finally:
+      self.building = False
+
+  @property
+  def tracking(self) -> bool:
+    """ Whether member and guild events should be applied to the index """
+    return self.built or self.building
+
+  def add(self, guild_id:int, user_id:int):
+    self.users.setdefault(user_id, set()).add(guild_id)
+
+  def remove(self, guild_id:int, user_id:int):
+    if (guild_ids := self.users.get(user_id)) is not None:
+      guild_ids.discard(guild_id)
+      if not guild_ids:
+        del self.users[user_id]
+
+  def add_guild(self, guild:discord.Guild):
+    for member in guild.members:
+      self.users.setdefault(member.id, set()).add(guild.id)
+
+  def remove_guild(self, guild:discord.Guild):
+    for member in guild.members:
+      self.remove(guild.id, member.id)
+
+  def get(self, user_id:int) -> set[int]:
+    """ Returns the ids of guilds the user shares with the bot, this must not be modified """
+    return self.users.get(user_id, set())
+
+  def stats(self) -> dict[str, int]:
+    """ Index size and approximate memory usage in bytes for monitoring """
+    return {
+      'users': len(self.users),
+      'memberships': sum(len(g) for g in self.users.values()),
+      'bytes': sys.getsizeof(self.users) + sum(sys.getsizeof(g) for g in self.users.values())
+    }
+
+
+class ThreadIndex:
+  """
+    Index of the public threads in each channel which can receive confessions
+
+    discord.py finds a channel's threads by walking every thread in the guild, so each guild is
+    walked once and then kept up to date with thread events. Recently archived threads can also be
+    included, these are fetched once per channel and cached.
+  """
+  def __init__(self):
+    self.active:dict[int, dict[int, discord.Thread]] = {}
+    self.archived:dict[int, dict[int, discord.Thread]] = {}
+    self.guilds:set[int] = set()
+
+  def threads(self, channel:discord.TextChannel) -> list[discord.Thread]:
+    """ Returns the active public threads in channel, and archived ones if they've been fetched """
+    if channel.guild.id not in self.guilds:
+      for thread in channel.guild.threads:
+        self.add(thread)
+      self.guilds.add(channel.guild.id)
+    threads = list(self.active.get(channel.id, {}).values())
+    if archived := self.archived.get(channel.id):
+      threads += [t for t in archived.values() if t.id not in self.active.get(channel.id, {})]
+    return threads
+
+  def add(self, thread:discord.Thread):
+    """ Index a new or updated thread, if it's eligible """
+    self.remove(thread.id, thread.parent_id)
+    if thread.type != discord.ChannelType.public_thread:
+      return
+    if not thread.archived:
+      self.active.setdefault(thread.parent_id, {})[thread.id] = thread
+    elif (archived := self.archived.get(thread.parent_id)) is not None:
+      archived[thread.id] = thread
+
+  def remove(self, thread_id:int, parent_id:int):
+    if (threads := self.active.get(parent_id)) is not None:
+      threads.pop(thread_id, None)
+    if (threads := self.archived.get(parent_id)) is not None:
+      threads.pop(thread_id, None)
+
+  def needs_archived(self, channel_id:int) -> bool:
+    return channel_id not in self.archived
+
+  async def fetch_archived(self, channel:discord.TextChannel, limit:int):
+    """ Fetch the most recently archived public threads in channel, only once per channel """
+    # Claimed straight away so concurrent scans don't fetch again
+    archived = self.archived[channel.id] = {}
+    try:
+      async for thread in channel.archived_threads(limit=limit):
+        archived.setdefault(thread.id, thread)
+    except discord.HTTPException:
+      pass
+
+  def forget_channel(self, channel_id:int):
+    self.active.pop(channel_id, None)
+    self.archived.pop(channel_id, None)
+
+  def forget_guild(self, guild:discord.Guild):
+    self.guilds.discard(guild.id)
+    for channel in guild.channels:
+      self.forget_channel(channel.id)
+
+
+class RateLimiter:
+  """
+    Token buckets which limit how quickly each user and guild can send messages
+
+    Limits are written as `count/seconds`, a bucket holds `count` sends and refills over `seconds`.
+    A full bucket is the same as no bucket, so buckets are only kept while they are refilling.
+    Buckets are ordered by when they were last spent, so the least recently spent are evicted past
+    MAXSIZE. Limits refill at different rates, so refilled buckets are pruned by scanning every
+    bucket, at most once every PRUNE_INTERVAL seconds.
+  """
+  MAXSIZE = 100000
+  PRUNE_INTERVAL = 60.0
+  rejected:int = 0
+
+  def __init__(self):
+    # key -> (tokens, updated, full_at)
+    self.buckets:OrderedDict[tuple[str, int, int], tuple[float, float, float]] = OrderedDict()
+    self.next_prune = 0.0
+
+  @staticmethod
+  def parse(limit:Optional[str]) -> Optional[tuple[int, float]]:
+    """ Parse a `count/seconds` limit, returns None if the limit is empty, zero or invalid """
+    count, _, seconds = (limit or '').partition('/')
+    try:
+      parsed = int(count), float(seconds)
+    except ValueError:
+      return None
+    return parsed if parsed[0] > 0 and parsed[1] > 0 else None
+
+  def acquire(self, limits:list[tuple[tuple[str, int, int], tuple[int, float]]]) -> float:
+    """
+      Spend one send from each (key, limit) bucket, only if every bucket has one to spend
+      Returns 0 on success, or the seconds until all of the buckets will have a send available
+    """
+    now = time.monotonic()
+    self.prune(now)
+    levels = []
+    wait = 0.0
+    for key, (count, seconds) in limits:
+      tokens, updated, _ = self.buckets.get(key, (count, now, now))
+      tokens = min(count, tokens + (now - updated) * count / seconds)
+      if tokens < 1:
+        wait = max(wait, (1 - tokens) * seconds / count)
+      levels.append((key, count, seconds, tokens))
+    if wait:
+      self.rejected += 1
+      return wait
+    for key, count, seconds, tokens in levels:
+      tokens -= 1
+      self.buckets[key] = (tokens, now, now + (count - tokens) * seconds / count)
+      self.buckets.move_to_end(key)
+    while len(self.buckets) > self.MAXSIZE:
+      self.buckets.popitem(last=False)
+    return 0.0
+
+  def prune(self, now:float):
+    """ Drop every refilled bucket, if PRUNE_INTERVAL has passed since the last prune """
+    if now < self.next_prune:
+      return
+    self.next_prune = now + self.PRUNE_INTERVAL
+    for key in [key for key, (_, _, full_at) in self.buckets.items() if full_at <= now]:
+      del self.buckets[key]
+
+  def stats(self) -> dict[str, float]:
+    """ Bucket counts for monitoring """
+    return {'buckets': len(self.buckets), 'rejected': self.rejected}
+
+
+class LockRegistry:
+  """
+    Locks which stop the same confession from being handled twice at once
+
+    A lock is released when its `hold()` block exits, or after `ttl` seconds if the handler hangs,
+    so a failed handler can never leave a button locked. Every lock has the same ttl, so the
+    oldest locks are always at the front and expired ones can be pruned from there.
+  """
+  TTL = 300.0
+  acquired:int = 0
+  contended:int = 0
+
+  def __init__(self, ttl:float = TTL):
+    self.ttl = ttl
+    # key -> expiry, which also identifies this holder of the lock
+    self.locks:dict[str, float] = {}
+
+  def acquire(self, key:str) -> Optional[float]:
+    """ Take the lock for key, returns a token for release(), or None if it's already held """
+    now = time.monotonic()
+    while self.locks:
+      oldest, expiry = next(iter(self.locks.items()))
+      if expiry > now:
+        break
+      del self.locks[oldest]
+    if key in self.locks:
+      self.contended += 1
+      return None
+    self.acquired += 1
+    token = self.locks[key] = now + self.ttl
+    return token
+
+  def release(self, key:str, token:float):
+    """ Release the lock for key, unless it expired and has been taken by somebody else """
+    if self.locks.get(key) == token:
+      del self.locks[key]
+
+  @asynccontextmanager
+  async def hold(self, key:str) -> AsyncIterator[bool]:
+    """ Hold the lock for key until the block exits, yields False if somebody else holds it """
+    token = self.acquire(key)
+    if token is None:
+      yield False
+      return
+    try:
+      yield True
+    finally:
+      self.release(key, token)
+
+  def stats(self) -> dict[str, float]:
+    """ Lock counts and how often a lock was already held, for monitoring """
+    return {
+      'held': len(self.locks),
+      'acquired': self.acquired,
+      'contended': self.contended,
+      'contention': self.contended / (self.acquired + self.contended) if self.acquired else 0.0
+    }
+
+
+type InteractionHandler = Callable[[discord.Interaction], Coroutine[Any, Any, Any]]
+
+
+class InteractionRouter:
+  """
+    Routes component interactions to a handler by the prefix of their custom_id
+
+    Prefixes are stored in a trie, so finding the handler takes one walk over the custom_id no
+    matter how many routes there are, and the longest matching prefix wins. This lets a cog
+    register a fallback for a short prefix which other cogs can override with longer ones.
+    A fallback can also be overridden for the same prefix, and is restored when the override is
+    unregistered.
+  """
+  def __init__(self):
+    # Each node maps characters to child nodes, the routes for a prefix are stored under the key ''
+    #  with fallbacks first, the last route is the one in use
+    self.root:dict[str, Any] = {}
+    self.timings:dict[str, list[float]] = {}
+
+  def register(self, prefix:str, handler:InteractionHandler, fallback:bool = False):
+    """ Route custom_ids starting with prefix to handler, overriding any existing route """
+    node = self.root
+    for char in prefix:
+      node = node.setdefault(char, {})
+    routes:list[tuple[str, InteractionHandler]] = node.setdefault('', [])
+    routes[:] = [route for route in routes if route[1] != handler]
+    routes.insert(0 if fallback else len(routes), (prefix, handler))
+    self.timings.setdefault(prefix, [0, 0.0, 0.0])
+
+  def unregister(self, prefix:str, handler:Optional[InteractionHandler] = None):
+    """ Remove handler's route for prefix, or every route for prefix if handler is None """
+    path = [self.root]
+    for char in prefix:
+      if char not in path[-1]:
+        return
+      path.append(path[-1][char])
+    if handler is not None and (routes := path[-1].get('')):
+      routes[:] = [route for route in routes if route[1] != handler]
+      if routes:
+        return
+    path[-1].pop('', None)
+    # Prune nodes which no longer lead to any routes
+    for i in reversed(range(len(prefix))):
+      if path[i + 1]:
+        break
+      del path[i][prefix[i]]
+
+  def match(self, custom_id:str) -> Optional[tuple[str, InteractionHandler]]:
+    """ Returns the route with the longest prefix of custom_id, or None """
+    node = self.root
+    route = node[''][-1] if '' in node else None
+    for char in custom_id:
+      if (node := node.get(char)) is None:
+        break
+      if '' in node:
+        route = node[''][-1]
+    return route
+
+  async def dispatch(self, inter:discord.Interaction) -> bool:
+    """ Call the handler for a component interaction, returns False if it has no route """
+    if inter.type != discord.InteractionType.component or inter.data is None:
+      return False
+    if (route := self.match(inter.data.get('custom_id', ''))) is None:
+      return False
+    prefix, handler = route
+    start = time.perf_counter()
+    try:
+      await handler(inter)
+    finally:
+      elapsed = time.perf_counter() - start
+      timing = self.timings.setdefault(prefix, [0, 0.0, 0.0])
+      timing[0] += 1
+      timing[1] += elapsed
+      timing[2] = max(timing[2], elapsed)
+    return True
+
+  def stats(self) -> dict[str, dict[str, float]]:
+    """ Dispatch counts and timings for each route, for monitoring """
+    return {
+      prefix: {'calls': calls, 'avg_time': total / calls if calls else 0.0, 'max_time': peak}
+      for prefix, (calls, total, peak) in self.timings.items()
+    }
+
+
+anonid_cache = AnonIdCache()
+spam_filter = SpamFilter()
+badword_cache = BadwordCache()
+webhook_cache = WebhookCache()
+send_queue = SendQueue()
+digest_batcher = DigestBatcher()
+resolver = Resolver()
+mutual_guilds = MutualGuildIndex()
+thread_index = ThreadIndex()
+rate_limiter = RateLimiter()
+interaction_router = InteractionRouter()
+
+
+def forget_guild(guild_id:int):
+  """ Drop everything held in memory for a guild, once its stored data has been removed """
+  channel_registry.forget(guild_id)
+  anonid_cache.forget(guild_id)
+  badword_cache.forget(guild_id)
+  webhook_cache.forget_guild(guild_id)
 
 
 class ConfessionData:
@@ -509,6 +1431,7 @@ class ConfessionData:
     # Aliases to shorten code
     self.parent = parent
     self.config = parent.config
+    self.guildstore = parent.store
     self.babel = parent.babel
     self.bot = parent.bot
 
@@ -530,20 +1453,23 @@ class ConfessionData:
       reference_id = int.from_bytes(binary[18:26], 'big')
     else:
       raise CorruptConfessionDataException("Data format incorrect;", len(binary), "!=", 26)
-    targetchannel = await self.bot.fetch_channel(targetchannel_id)
-    assert isinstance(targetchannel, discord.TextChannel)
-    self.author = await targetchannel.guild.fetch_member(author_id)
-    self.target = targetchannel
+    try:
+      self.target = await resolver.channel(self.bot, targetchannel_id)
+    except TypeError as e:
+      # The target channel has been replaced with one that can't be confessed in
+      raise CorruptConfessionDataException(*e.args) from e
+    self.author = await resolver.member(self.target.guild, author_id)
     self.anonid = self.get_anonid(self.target.guild.id, self.author.id)
-    guildchannels = get_guildchannels(self.config, self.target.guild.id)
-    self.channeltype = guildchannels.get(
-      self.target.parent_id if isinstance(self.target, discord.Thread) else self.target.id,
-      ChannelType.unset
+    self.channeltype = get_channeltype(
+      self.config,
+      self.target.parent_id if isinstance(self.target, discord.Thread) else self.target.id
     )
     self.targetchanneltype = self.channeltype
-    # References must exist in the cache, meaning confession replies will not survive a restart
-    # Note: this assumes the data will only be retreived once
-    self.reference = referenced_message_cache.pop(reference_id, None)
+    references = self.guildstore.references
+    if reference_id and (channel_id := references.get(self.target.guild.id, reference_id)):
+      channel = self.target.guild.get_channel_or_thread(channel_id)
+      if isinstance(channel, (discord.TextChannel, discord.Thread)):
+        self.reference = channel.get_partial_message(reference_id)
 
   def create(
     self,
@@ -566,10 +1492,8 @@ class ConfessionData:
     self.anonid = self.get_anonid(target.guild.id, author.id)
     if reference:
       self.reference = reference
-    guildchannels = get_guildchannels(self.config, target.guild.id)
-    self.channeltype = guildchannels.get(
-      target.parent_id if isinstance(target, discord.Thread) else target.id,
-      ChannelType.unset
+    self.channeltype = get_channeltype(
+      self.config, target.parent_id if isinstance(target, discord.Thread) else target.id
     )
     self.targetchanneltype = self.channeltype
 
@@ -586,24 +1510,36 @@ class ConfessionData:
         else:
           self.content = embed.description
 
-  async def add_image(self, *, attachment:discord.Attachment | None = None, url:str | None = None):
-    """ Download image so it can be reuploaded with message """
-    async with aiohttp.ClientSession() as session:
-      targeturl = attachment.url if attachment else url
-      assert targeturl is not None
-      async with session.get(targeturl) as res:
-        if res.status == 200:
-          filename = 'file.'+res.content_type.replace('image/','')
-          self.file = discord.File(
-            io.BytesIO(await res.read()),
-            filename
-          )
-          if self.embed:
-            self.embed.set_image(url='attachment://'+self.file.filename)
-          if attachment:
-            self.attachment = attachment
-        else:
-          raise Exception("Failed to download image!")
+  async def add_image(
+    self, *, attachment:discord.Attachment | None = None, url:str | None = None
+  ) -> bool:
+    """
+      Download image so it can be reuploaded with message, returns False if it couldn't be
+      The file is left unset on failure, so check_image will reject it as invalid
+    """
+    if attachment:
+      self.attachment = attachment
+      if (
+        attachment.content_type is None or not attachment.content_type.startswith('image') or
+        attachment.size >= self.target.guild.filesize_limit
+      ):
+        # check_image will reject this, so don't waste time downloading it
+        return False
+    targeturl = attachment.url if attachment else url
+    assert targeturl is not None
+    cog = cast("Confessions", self.bot.cogs['Confessions'])
+    try:
+      self.set_image(*await cog.image_fetcher.fetch(targeturl, self.target.guild.filesize_limit))
+    except ImageDownloadError:
+      # Unsupported formats and images over the size limit
+      return False
+    return True
+
+  def set_image(self, fp:IO[bytes], ext:str):
+    """ Attach an image file which has already been downloaded """
+    self.file = discord.File(fp, 'file.'+ext)
+    if self.embed:
+      self.embed.set_image(url='attachment://'+self.file.filename)
 
   # Data storage
 
@@ -616,13 +1552,8 @@ class ConfessionData:
     bflags = self.channeltype_flags.to_bytes(1, 'big')
     if self.reference:
       breference = self.reference.id.to_bytes(8, 'big')
-      # Store in cache so it can be restored
-      referenced_message_cache[self.reference.id] = self.reference
-      # Prevent a memory leak
-      if len(referenced_message_cache) > 100:
-        # Chances are older items in this list are not going to be approved or denied
-        # It's also possible the vet message is deleted
-        referenced_message_cache.popitem(last=False)
+      # Only the message id fits, so remember its channel until the confession is vetted
+      self.guildstore.references.put(self.target.guild.id, self.reference.channel.id, self.reference.id)
     else:
       breference = int(0).to_bytes(8, 'big')
 
@@ -633,14 +1564,21 @@ class ConfessionData:
 
   def get_anonid(self, guildid:int, userid:int) -> str:
     """ Calculates the current anon-id for a user """
-    salt = b64decode(self.config.get(f"{guildid}_shuffle", fallback=''))
-    if len(salt) < 16: # If server does not yet have a salt
-      salt = self.parent.crypto.srandom_token()
-      self.config[f"{guildid}_shuffle"] = b64encode(salt).decode('ascii')
+    if anonid := anonid_cache.get(guildid, userid):
+      return anonid
+    salt = anonid_cache.salts.get(guildid)
+    if salt is None:
+      salt = b64decode(self.guildstore.get(guildid, 'shuffle', fallback=''))
+      if len(salt) < 16: # If server does not yet have a salt
+        salt = self.parent.crypto.srandom_token()
+        self.guildstore.set(guildid, 'shuffle', b64encode(salt).decode('ascii'))
+      anonid_cache.salts[guildid] = salt
     hashed = self.parent.crypto.hash(
       guildid.to_bytes(8, 'big') + userid.to_bytes(8, 'big'), salt
     )
-    return hashed.hex()[-6:]
+    anonid = hashed.hex()[-6:]
+    anonid_cache.put(guildid, userid, anonid)
+    return anonid
 
   def generate_embed(self):
     """ Generate or add anonid to the confession embed """
@@ -661,7 +1599,7 @@ class ConfessionData:
   def check_banned(self) -> bool:
     """ Verify the user hasn't been banned """
     guild_id = self.target.guild.id
-    if self.anonid in self.config.get(f"{guild_id}_banned", fallback='').split(','):
+    if self.anonid in self.guildstore.bans(guild_id):
       return False
     return True
 
@@ -669,31 +1607,32 @@ class ConfessionData:
     """ Only allow images to be sent if imagesupport is enabled and the image is valid """
     image = self.attachment
     guild_id = self.target.guild.id
-    if image:
+    if image and self.file:
       assert image.content_type is not None
       if image.content_type.startswith('image') and image.size < self.target.guild.filesize_limit:
         # Discord size limit
-        if self.config.getboolean(f"{guild_id}_imagesupport", fallback=True):
+        if self.guildstore.getboolean(guild_id, 'imagesupport', fallback=True):
           return True
         return False
     raise commands.BadArgument()
 
   def check_spam(self):
     """ Verify message doesn't contain spam as defined in [confessions] spam_flags """
-    for spamflag in self.config.get('spam_flags', fallback='').splitlines():
-      if self.content and re.match(spamflag, self.content):
-        return False
+    spam_filter.update(self.config.get('spam_flags', fallback=''))
+    if self.content and (spamflag := spam_filter.match(self.content)):
+      if self.bot.verbose:
+        print("Blocked a message matching spam flag", spamflag)
+      return False
     return True
 
   def check_badwords(self, inter:discord.Interaction):
-    """ Verify message doesn't contain spam as defined in [confessions] spam_flags """
-    key = f'{inter.guild_id}_badwords'
-    badwords = self.config.get(key, fallback='')
-    if len(badwords) == 0:
+    """ Verify message doesn't contain any of the words blocked on this server """
+    assert inter.guild_id is not None
+    badwords = self.guildstore.get(inter.guild_id, 'badwords', fallback='')
+    if not badwords or not self.content:
       return True
-    for badword in badwords.split(','):
-      if self.content and badword.strip().lower() in self.content.lower():
-        return False
+    if badword_cache.get(inter.guild_id, badwords).search(self.content):
+      return False
     return True
 
   async def check_vetting(
@@ -702,8 +1641,7 @@ class ConfessionData:
   ) -> discord.TextChannel | Literal[False] | None:
     """ Check if vetting is required, this is not a part of check_all """
     send = (inter.followup.send if inter.response.is_done() else inter.response.send_message)
-    guildchannels = get_guildchannels(self.config, self.target.guild.id)
-    vetting = findvettingchannel(guildchannels)
+    vetting = get_vettingchannel(self.config, self.target.guild.id)
     if vetting and self.targetchanneltype.vetted:
       if 'ConfessionsModeration' not in self.bot.cogs:
         await send(self.babel(inter, 'no_moderation'), ephemeral=True)
@@ -816,20 +1754,19 @@ class ConfessionData:
     if target is None:
       target = self.target
     # Update channeltype, in case this channel is different
-    guildchannels = get_guildchannels(self.config, target.guild.id)
-    self.channeltype = guildchannels.get(
-      target.parent_id if isinstance(target, discord.Thread) else target.id, ChannelType.unset
+    self.channeltype = get_channeltype(
+      self.config, target.parent_id if isinstance(target, discord.Thread) else target.id
     )
     if perform_checks:
       if not await self.check_all(inter):
         return False
     preface = (
       preface_override if preface_override is not None
-      else self.config.get(f'{target.guild.id}_preface', fallback='')
+      else self.guildstore.get(target.guild.id, 'preface', fallback='')
     )
     use_webhook = (
       webhook_override if webhook_override is not None
-      else self.config.getboolean(f'{target.guild.id}_webhook', False)
+      else self.guildstore.getboolean(target.guild.id, 'webhook', fallback=False)
     )
 
     # Allow external modules to modify the message before sending
@@ -866,8 +1803,11 @@ class ConfessionData:
         preface += '\n' + self.babel(target.guild, 'reply_to', reference=self.reference.jump_url)
 
     # Send the confession
+    func:Coroutine | None = None
+    digest = False
+    concurrency = 1
     if use_webhook:
-      if webhook := await self.find_or_create_webhook(target):
+      if await self.find_or_create_webhook(target):
         if isinstance(target, discord.Thread):
           kwargs['thread'] = target
         mentions_in_preface = re.findall(r'<[@!&]+\d+>', preface)
@@ -886,7 +1826,9 @@ class ConfessionData:
           ('> ' + preface + '\n' if mentions_in_preface else '') +
           (self.content if self.content else '')
         )
-        func = webhook.send(content, username=username, avatar_url=pfp, **kwargs)
+        # The webhook is picked when the message leaves the queue, so bursts rotate through the pool
+        func = self.send_webhook(target, content, username=username, avatar_url=pfp, **kwargs)
+        concurrency = self.config.getint('webhook_pool_size', fallback=1)
         #TODO: add support for custom PFPs
       else:
         return False
@@ -894,8 +1836,38 @@ class ConfessionData:
       self.generate_embed()
       if self.embed:
         kwargs['embed'] = self.embed
-      func = target.send(preface, **kwargs)
-    success = await self.handle_send_errors(inter, func)
+      # Digests can't carry replies or views, so those are always sent straight away
+      if (
+        target == self.target and self.embed and not self.reference and 'view' not in kwargs and
+        str(target.id) in self.guildstore.get(target.guild.id, 'digest', fallback='').split(',')
+      ):
+        digest = True
+      else:
+        func = target.send(preface, **kwargs)
+
+    send = (inter.followup.send if inter.response.is_done() else inter.response.send_message)
+    try:
+      if digest:
+        assert self.embed is not None
+        pending = digest_batcher.add(
+          target, preface, self.embed, self.file, self.config.getfloat('digest_window', fallback=10)
+        )
+      else:
+        # Wait in line behind any other messages being sent to this channel
+        assert func is not None
+        pending = send_queue.submit(
+          target.parent_id if isinstance(target, discord.Thread) else target.id, func, concurrency
+        )
+        notify_after = self.config.getfloat('send_queue_notify', fallback=3.0)
+        done, _ = await asyncio.wait((pending,), timeout=notify_after)
+        if not done:
+          await send(self.babel(inter, 'confession_queued', channel=target.mention), ephemeral=True)
+      success = await self.handle_send_errors(inter, pending)
+    except asyncio.QueueFull:
+      if func:
+        func.close()
+      await send(self.babel(inter, 'confession_queue_full', channel=target.mention), ephemeral=True)
+      return False
 
     if 'Log' in self.bot.cogs and target == self.target:
       logentry = (
@@ -916,16 +1888,28 @@ class ConfessionData:
         await inter.followup.send(self.babel(inter, 'confession_sent_below'), ephemeral=True)
     return success
 
+  async def send_webhook(self, target:Confessable, *args, **kwargs):
+    """ Send with the least busy cached webhook, dropping it from the cache if it has been deleted """
+    channel = target.parent if isinstance(target, discord.Thread) else target
+    assert isinstance(channel, discord.TextChannel)
+    webhook = await webhook_cache.fetch(
+      self.bot, channel, self.config.getint('webhook_pool_size', fallback=1)
+    )
+    try:
+      await webhook.send(*args, **kwargs)
+    except discord.NotFound:
+      webhook_cache.discard(webhook)
+      raise
+
   async def find_or_create_webhook(self, target:Confessable) -> discord.Webhook | None:
     """ Tries to find a webhook, or create it, or complain about missing permissions """
-    webhook:discord.Webhook
     channel = target.parent if isinstance(target, discord.Thread) else target
     assert isinstance(channel, discord.TextChannel)
     try:
-      for webhook in await channel.webhooks():
-        if webhook.user == self.bot.user:
-          return webhook
-      return await channel.create_webhook(name=self.bot.config['main']['botname'])
+      pool = await webhook_cache.load(
+        self.bot, channel, self.config.getint('webhook_pool_size', fallback=1)
+      )
+      return pool[0]
     except discord.Forbidden:
       await channel.send(self.babel(channel.guild, 'missingperms', perm='Manage Webhooks'))
       return None
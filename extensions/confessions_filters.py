@@ -0,0 +1,211 @@
+"""
+  Confessions Filters - Precompiled content filters for anonymous messages
+  Note: Do not enable as an extension, code in here is used implicitly
+  To reload, reload each of the enabled confessions modules
+"""
+from __future__ import annotations
+
+import re, unicodedata
+from collections import deque
+from typing import Optional, Iterable, Callable
+
+
+class SpamFilter:
+  """
+    Matches messages against [confessions] spam_flags
+
+    All flags are compiled into a single alternation so a clean message is rejected in one pass.
+    Flags are only rebuilt when the source string changes.
+  """
+  source:Optional[str] = None
+  flags:list[re.Pattern]
+  combined:Optional[re.Pattern] = None
+
+  def __init__(self, source:str = ''):
+    self.flags = []
+    self.update(source)
+
+  def update(self, source:str):
+    """ Recompile the flags if they have changed, one flag per line """
+    if source == self.source:
+      return
+    self.flags = [re.compile(flag) for flag in source.splitlines()]
+    self.combined = None
+    # Numbered groups would be renumbered in the alternation, breaking backreferences
+    if self.flags and not any(flag.groups for flag in self.flags):
+      try:
+        self.combined = re.compile('|'.join(f'(?:{flag.pattern})' for flag in self.flags))
+      except re.error:
+        # Some flags can't be combined, like inline global flags
+        pass
+    self.source = source
+
+  def match(self, content:str) -> Optional[str]:
+    """ Returns the first flag which matches the start of content, or None """
+    if self.combined is not None and not self.combined.match(content):
+      return None
+    for flag in self.flags:
+      if flag.match(content):
+        return flag.pattern
+    return None
+
+
+# Characters which are commonly swapped in to get around word filters, mapped to their latin lookalike
+CONFUSABLES = str.maketrans({
+  # Cyrillic
+  'а':'a', 'в':'b', 'е':'e', 'ё':'e', 'к':'k', 'м':'m', 'н':'h', 'о':'o', 'р':'p', 'с':'c', 'т':'t',
+  'у':'y', 'х':'x', 'ѕ':'s', 'і':'i', 'ї':'i', 'ј':'j', 'ԁ':'d', 'ԛ':'q', 'ԝ':'w', 'һ':'h',
+  # Greek
+  'α':'a', 'β':'b', 'ε':'e', 'η':'n', 'ι':'i', 'κ':'k', 'ν':'v', 'ο':'o', 'ρ':'p', 'τ':'t', 'υ':'u',
+  'χ':'x', 'ω':'w',
+  # Invisible characters
+  '\u00ad':None, '\u200b':None, '\u200c':None, '\u200d':None, '\u2060':None, '\ufeff':None
+})
+
+
+def normalize(text:str) -> str:
+  """ Case-fold text and replace lookalike characters so filters can't be evaded with them """
+  if text.isascii():
+    return text.lower()
+  # NFKD splits accents off their letters and flattens fullwidth and stylised letters
+  text = ''.join(c for c in unicodedata.normalize('NFKD', text) if not unicodedata.combining(c))
+  return text.casefold().translate(CONFUSABLES)
+
+
+class BadwordFilter:
+  """
+    Aho-Corasick automaton which finds any of a list of words in one pass over a message
+    Matching is done on normalized text, so it is case-insensitive and resistant to lookalikes
+  """
+  def __init__(self, words:Iterable[str]):
+    self.goto:list[dict[str, int]] = [{}]
+    self.fail:list[int] = [0]
+    self.output:list[Optional[str]] = [None]
+
+    for word in words:
+      word = word.strip()
+      if not word:
+        continue
+      state = 0
+      for char in normalize(word):
+        if char not in self.goto[state]:
+          self.goto.append({})
+          self.fail.append(0)
+          self.output.append(None)
+          self.goto[state][char] = len(self.goto) - 1
+        state = self.goto[state][char]
+      if self.output[state] is None:
+        self.output[state] = word
+
+    # Breadth-first to link every state to the longest suffix which is also in the trie
+    queue = deque(self.goto[0].values())
+    while queue:
+      state = queue.popleft()
+      for char, nextstate in self.goto[state].items():
+        queue.append(nextstate)
+        fallback = self.fail[state]
+        while fallback and char not in self.goto[fallback]:
+          fallback = self.fail[fallback]
+        self.fail[nextstate] = self.goto[fallback].get(char, 0)
+        if self.output[nextstate] is None:
+          self.output[nextstate] = self.output[self.fail[nextstate]]
+
+  def search(self, content:str) -> Optional[str]:
+    """ Returns the first word found in content, or None """
+    goto, fail, output = self.goto, self.fail, self.output
+    state = 0
+    for char in normalize(content):
+      while state and char not in goto[state]:
+        state = fail[state]
+      state = goto[state].get(char, 0)
+      if output[state] is not None:
+        return output[state]
+    return None
+
+
+class BadwordCache:
+  """ Keeps a BadwordFilter for each guild until that guild's word list changes """
+  def __init__(self):
+    self.filters:dict[int, tuple[str, BadwordFilter]] = {}
+
+  def get(self, guild_id:int, source:str) -> BadwordFilter:
+    """ Returns the filter for a comma-separated list of words, rebuilding it if the list changed """
+    cached = self.filters.get(guild_id)
+    if cached is None or cached[0] != source:
+      cached = (source, BadwordFilter(source.split(',')))
+      self.filters[guild_id] = cached
+    return cached[1]
+
+  def forget(self, guild_id:int):
+    self.filters.pop(guild_id, None)
+
+
+class SearchIndex[T]:
+  """
+    Case-insensitive search over a list of names, which can be reused for every query
+
+    Results are ranked by names or words within them that start with the query, then names which
+    contain it, then names sharing most of their trigrams with it. Ties keep their original order.
+  """
+  FUZZY_THRESHOLD = 0.5
+  WORD_SPLIT = re.compile(r'[\s/_\-]+')
+
+  def __init__(self, entries:Iterable[tuple[T, str]]):
+    self.values:list[T] = []
+    self.keys:list[str] = []
+    self.words:list[list[str]] = []
+    self.trigrams:dict[str, list[int]] = {}
+    for value, name in entries:
+      key = normalize(name)
+      for trigram in set(trigrams(key)):
+        self.trigrams.setdefault(trigram, []).append(len(self.values))
+      self.values.append(value)
+      self.keys.append(key)
+      self.words.append(self.WORD_SPLIT.split(key))
+
+  def search(self, query:str, limit:int, accept:Callable[[T], bool] = lambda _: True) -> list[T]:
+    """ Returns up to limit accepted values which match query, best matches first """
+    query = normalize(query)
+    prefix:list[int] = []
+    substring:list[int] = []
+    fuzzy:list[tuple[float, int]] = []
+    if len(query) < 3:
+      # Too short for trigrams, but a short scan can stop as soon as it has enough prefix matches
+      for i, key in enumerate(self.keys):
+        if query in key and accept(self.values[i]):
+          if key.startswith(query) or any(w.startswith(query) for w in self.words[i]):
+            prefix.append(i)
+            if len(prefix) >= limit:
+              break
+          else:
+            substring.append(i)
+    else:
+      querytrigrams = set(trigrams(query))
+      hits:dict[int, int] = {}
+      for trigram in querytrigrams:
+        for i in self.trigrams.get(trigram, ()):
+          hits[i] = hits.get(i, 0) + 1
+      for i in sorted(hits):
+        if not accept(self.values[i]):
+          continue
+        key = self.keys[i]
+        if query in key:
+          if key.startswith(query) or any(w.startswith(query) for w in self.words[i]):
+            prefix.append(i)
+          else:
+            substring.append(i)
+        elif (similarity := hits[i] / len(querytrigrams)) >= self.FUZZY_THRESHOLD:
+          fuzzy.append((-similarity, i))
+      fuzzy.sort()
+    ranked = prefix + substring + [i for _, i in fuzzy]
+    return [self.values[i] for i in ranked[:limit]]
+
+
+def trigrams(text:str) -> list[str]:
+  """ Every run of three characters in text """
+  return [text[i:i+3] for i in range(len(text) - 2)]
+
+
+async def setup(_):
+  """ Refuse to bind this cog to the bot """
+  raise Exception("This module is not meant to be imported as an extension!")
@@ -0,0 +1,244 @@
+"""
+  Confessions Images - Image downloads for anonymous messages
+  Note: Do not enable as an extension, code in here is used implicitly
+  To reload, reload each of the enabled confessions modules
+"""
+from __future__ import annotations
+
+import asyncio, hashlib, os, threading, time
+from tempfile import SpooledTemporaryFile
+from typing import Optional, IO
+import aiohttp
+
+
+class ImageDownloadError(Exception):
+  """ Raised when an image couldn't be downloaded """
+
+
+class ImageTooLargeError(ImageDownloadError):
+  """ Raised when an image is larger than the size limit """
+
+
+# Magic bytes which begin each supported image format, mapped to its file extension
+SIGNATURES:tuple[tuple[bytes, str], ...] = (
+  (b'\x89PNG\r\n\x1a\n', 'png'),
+  (b'\xff\xd8\xff', 'jpeg'),
+  (b'GIF87a', 'gif'),
+  (b'GIF89a', 'gif'),
+)
+SNIFF_LEN = 12
+
+
+def sniff_image(header:bytes) -> Optional[str]:
+  """ Returns the file extension for the image format that header begins, or None """
+  for signature, ext in SIGNATURES:
+    if header.startswith(signature):
+      return ext
+  if header[:4] == b'RIFF' and header[8:12] == b'WEBP':
+    return 'webp'
+  return None
+
+
+class ImageFetcher:
+  """
+    Downloads images over a pooled aiohttp session
+
+    Connections and DNS lookups are reused between downloads, so only the first image from a
+    host pays for TCP and TLS setup. Failed connections and server errors are retried briefly.
+    Images are streamed into memory, which never rolls over to disk as it's capped at the size limit.
+  """
+  LIMIT = 100
+  LIMIT_PER_HOST = 20
+  DNS_TTL = 300
+  CONNECT_TIMEOUT = 5.0
+  READ_TIMEOUT = 15.0
+  RETRIES = 2
+  RETRY_DELAY = 0.5
+  CHUNK_SIZE = 65536
+
+  def __init__(self):
+    self._session:aiohttp.ClientSession | None = None
+
+  @property
+  def session(self) -> aiohttp.ClientSession:
+    """ The shared session, created on first use so it binds to the running event loop """
+    if self._session is None or self._session.closed:
+      self._session = aiohttp.ClientSession(
+        connector=aiohttp.TCPConnector(
+          limit=self.LIMIT,
+          limit_per_host=self.LIMIT_PER_HOST,
+          ttl_dns_cache=self.DNS_TTL
+        ),
+        timeout=aiohttp.ClientTimeout(
+          total=None,
+          sock_connect=self.CONNECT_TIMEOUT,
+          sock_read=self.READ_TIMEOUT
+        )
+      )
+    return self._session
+
+  async def fetch(self, url:str, limit:int) -> tuple[SpooledTemporaryFile, str]:
+    """
+      Download an image no larger than limit bytes, returns the file and its extension
+      The format is detected from the file itself, so the content type isn't trusted
+    """
+    attempt = 0
+    while True:
+      try:
+        async with self.session.get(url) as res:
+          if res.status == 200:
+            return await self._stream(res, limit)
+          # Client errors, like expired attachment urls, won't be fixed by retrying
+          if res.status < 500 or attempt == self.RETRIES:
+            raise ImageDownloadError("Failed to download image!", res.status)
+      except (aiohttp.ClientConnectionError, asyncio.TimeoutError):
+        if attempt == self.RETRIES:
+          raise
+      attempt += 1
+      await asyncio.sleep(self.RETRY_DELAY * attempt)
+
+  async def _stream(self, res:aiohttp.ClientResponse, limit:int) -> tuple[SpooledTemporaryFile, str]:
+    # Sizes must stay under limit, just like check_image
+    if res.content_length is not None and res.content_length >= limit:
+      raise ImageTooLargeError("Image is too large!", res.content_length)
+    # Writes happen on the event loop, so the file must never roll over to disk
+    file = SpooledTemporaryFile(max_size=limit)
+    try:
+      ext = None
+      header = b''
+      size = 0
+      async for chunk in res.content.iter_chunked(self.CHUNK_SIZE):
+        size += len(chunk)
+        if size >= limit:
+          raise ImageTooLargeError("Image is too large!", size)
+        if ext is None:
+          header += chunk[:SNIFF_LEN]
+          if len(header) >= SNIFF_LEN:
+            ext = sniff_image(header)
+            if ext is None:
+              raise ImageDownloadError("Downloaded file is not a supported image!")
+        file.write(chunk)
+      if ext is None and (ext := sniff_image(header)) is None:
+        raise ImageDownloadError("Downloaded file is not a supported image!")
+      file.seek(0)
+      return file, ext
+    except BaseException:
+      file.close()
+      raise
+
+  async def close(self):
+    """ Close all pooled connections """
+    if self._session is not None:
+      await self._session.close()
+      self._session = None
+
+
+class ImageCache:
+  """
+    Bounded on-disk cache of images awaiting vetting
+
+    Images are stored once under the sha256 of their contents in `blobs/`, and each pending
+    confession gets a small file in `links/` naming its image. Links and images expire after
+    `ttl` seconds, and the oldest images are removed once the cache grows past `max_size`.
+    The cache is only scanned every `PRUNE_INTERVAL` puts, or sooner if it may be over `max_size`.
+    All file access happens in a worker thread.
+  """
+  PRUNE_INTERVAL = 50
+
+  def __init__(self, path:str, max_size:int, ttl:float):
+    self.blobdir = os.path.join(path, 'blobs')
+    self.linkdir = os.path.join(path, 'links')
+    self.max_size = max_size
+    self.ttl = ttl
+    self._lock = threading.Lock()
+    # Upper bound on the size of the cache since the last prune, None until the first prune
+    self._size:int | None = None
+    self._puts = 0
+    os.makedirs(self.blobdir, exist_ok=True)
+    os.makedirs(self.linkdir, exist_ok=True)
+
+  def _linkpath(self, key:str) -> str:
+    return os.path.join(self.linkdir, hashlib.sha256(key.encode()).hexdigest()[:32])
+
+  async def put(self, key:str, fp:IO[bytes], ext:str):
+    """ Store the image in fp under key, fp is rewound afterwards """
+    await asyncio.to_thread(self._put, key, fp, ext)
+
+  def _put(self, key:str, fp:IO[bytes], ext:str):
+    digest = hashlib.sha256()
+    tmp = os.path.join(self.blobdir, f'{os.getpid()}.{id(fp)}.tmp')
+    fp.seek(0)
+    with open(tmp, 'wb') as f:
+      while chunk := fp.read(65536):
+        digest.update(chunk)
+        f.write(chunk)
+    fp.seek(0)
+    blob = digest.hexdigest() + '.' + ext
+    with self._lock:
+      # Identical images share one blob
+      os.replace(tmp, os.path.join(self.blobdir, blob))
+      with open(self._linkpath(key), 'w', encoding='ascii') as f:
+        f.write(blob)
+      self._puts += 1
+      if self._size is not None:
+        self._size += fp.seek(0, os.SEEK_END)
+        fp.seek(0)
+      if self._size is None or self._size > self.max_size or self._puts >= self.PRUNE_INTERVAL:
+        self._prune()
+
+  async def get(self, key:str) -> Optional[tuple[IO[bytes], str]]:
+    """ Returns an open image file and its extension for key, if it's still cached """
+    return await asyncio.to_thread(self._get, key)
+
+  def _get(self, key:str) -> Optional[tuple[IO[bytes], str]]:
+    try:
+      with open(self._linkpath(key), encoding='ascii') as f:
+        blob = f.read()
+      return open(os.path.join(self.blobdir, blob), 'rb'), blob.rsplit('.', 1)[1]
+    except (OSError, IndexError):
+      return None
+
+  async def discard(self, key:str):
+    """ Forget the image for key, the image itself is removed by the next prune if unused """
+    await asyncio.to_thread(self._discard, key)
+
+  def _discard(self, key:str):
+    with self._lock:
+      try:
+        os.remove(self._linkpath(key))
+      except FileNotFoundError:
+        pass
+
+  def _prune(self):
+    """ Remove expired links, unused or expired images, then the oldest images while over max_size """
+    expiry = time.time() - self.ttl
+    linked = set()
+    for entry in os.scandir(self.linkdir):
+      if entry.stat().st_mtime < expiry:
+        os.remove(entry.path)
+        continue
+      with open(entry.path, encoding='ascii') as f:
+        linked.add(f.read())
+
+    blobs = []
+    total = 0
+    for entry in os.scandir(self.blobdir):
+      stat = entry.stat()
+      if entry.name not in linked or stat.st_mtime < expiry:
+        if not entry.name.endswith('.tmp') or stat.st_mtime < expiry:
+          os.remove(entry.path)
+        continue
+      blobs.append((stat.st_mtime, stat.st_size, entry.path))
+      total += stat.st_size
+    blobs.sort()
+    while total > self.max_size and blobs:
+      _, size, path = blobs.pop(0)
+      os.remove(path)
+      total -= size
+    self._size = total
+    self._puts = 0
+
+
+async def setup(_):
+  """ Refuse to bind this cog to the bot """
+  raise Exception("This module is not meant to be imported as an extension!")
@@ -8,9 +8,10 @@ from enum import IntEnum
 from base64 import b64encode, b64decode
 import discord
 from discord import app_commands
-from discord.ext import commands
 
-from .confessions_common import ConfessionCog, ChannelType, get_guildchannels, ConfessionData
+from .confessions_common import (
+  ConfessionCog, ChannelType, ConfessionData, interaction_router, get_channeltype
+)
 
 if TYPE_CHECKING:
   from main import MerelyBot
@@ -35,6 +36,14 @@ class ConfessionsMarketplace(ConfessionCog):
 
     cog = cast(ConfessionCog, bot.cogs['Confessions'])
     self.crypto = cog.crypto
+    interaction_router.register('confessionmarketplace_offer', self.on_create_offer)
+    interaction_router.register('confessionmarketplace_accept', self.on_accept_offer)
+    interaction_router.register('confessionmarketplace_withdraw', self.on_withdraw)
+
+  def cog_unload(self):
+    interaction_router.unregister('confessionmarketplace_offer')
+    interaction_router.unregister('confessionmarketplace_accept')
+    interaction_router.unregister('confessionmarketplace_withdraw')
 
   # Modals
 
@@ -73,8 +82,7 @@ class ConfessionsMarketplace(ConfessionCog):
     async def on_submit(self, inter:discord.Interaction):
       """ User has completed making their offer """
       assert inter.channel is not None and inter.guild is not None
-      guildchannels = get_guildchannels(self.parent.config, inter.guild.id)
-      if guildchannels.get(inter.channel.id, ChannelType.unset) != ChannelType.marketplace:
+      if get_channeltype(self.parent.config, inter.channel.id) != ChannelType.marketplace:
         await inter.response.send_message(self.parent.babel(inter, 'nosendchannel'), ephemeral=True)
         return
 
@@ -142,19 +150,6 @@ class ConfessionsMarketplace(ConfessionCog):
 
   # Events
 
-  @commands.Cog.listener('on_interaction')
-  async def check_button_click(self, inter:discord.Interaction):
-    """ Check the button press events and handle relevant ones """
-    if inter.type != discord.InteractionType.component:
-      return
-    assert inter.data is not None and 'custom_id' in inter.data
-    if inter.data['custom_id'].startswith('confessionmarketplace_offer'):
-      return await self.on_create_offer(inter)
-    if inter.data['custom_id'].startswith('confessionmarketplace_accept'):
-      return await self.on_accept_offer(inter)
-    if inter.data['custom_id'].startswith('confessionmarketplace_withdraw'):
-      return await self.on_withdraw(inter)
-
   async def on_create_offer(self, inter:discord.Interaction):
     """ Open the offer form when a user wants to make an offer on a listing """
     assert inter.message is not None
@@ -251,7 +246,6 @@ class ConfessionsMarketplace(ConfessionCog):
     description=app_commands.locale_str('sell_description_desc', scope=SCOPE),
     image=app_commands.locale_str('sell_image_desc', scope=SCOPE)
   )
-  @commands.cooldown(1, 1, type=commands.BucketType.user)
   async def sell(
     self,
     inter:discord.Interaction,
@@ -264,13 +258,15 @@ class ConfessionsMarketplace(ConfessionCog):
     """
       Start an anonymous listing
     """
+    if await self.check_ratelimit(inter):
+      return
     assert inter.guild is not None
     assert isinstance(inter.channel, (discord.TextChannel, discord.Thread))
-    guildchannels = get_guildchannels(self.config, inter.guild.id)
-    if inter.channel_id not in guildchannels:
+    channeltype = get_channeltype(self.config, inter.channel.id)
+    if channeltype == ChannelType.unset:
       await inter.response.send_message(self.babel(inter, 'nosendchannel'), ephemeral=True)
       return
-    if guildchannels[inter.channel_id] != ChannelType.marketplace:
+    if channeltype != ChannelType.marketplace:
       await inter.response.send_message(self.babel(
         inter, 'wrongcommand', cmd='confess', channel=inter.channel.mention
       ), ephemeral=True)
@@ -5,7 +5,7 @@
 """
 from __future__ import annotations
 
-import asyncio, re
+import asyncio, io, re
 from typing import Optional, TYPE_CHECKING, cast
 import discord
 from discord import app_commands
@@ -13,8 +13,10 @@ from discord.ext import commands
 
 from extensions.controlpanel import ControlPanelCog, Stringable
 from .confessions_common import (
-  ConfessionCog, ConfessionData, CorruptConfessionDataException, safe_fetch_target
+  ConfessionCog, ConfessionData, CorruptConfessionDataException, LockRegistry, interaction_router,
+  safe_fetch_target
 )
+from .confessions_images import ImageCache
 
 if TYPE_CHECKING:
   from main import MerelyBot
@@ -24,6 +26,7 @@ if TYPE_CHECKING:
 class ConfessionsModeration(ConfessionCog, ControlPanelCog):
   """ Moderate anonymous messaging on your server """
   SCOPE = 'confessions'
+  BLOCKLIST_MAX_SIZE = 65536
 
   @property
   def crypto(self) -> "Crypto":
@@ -36,12 +39,21 @@ class ConfessionsModeration(ConfessionCog, ControlPanelCog):
 
   def __init__(self, bot:MerelyBot):
     self.bot = bot
-    self.button_lock:list[str] = []
+    self.button_lock = LockRegistry()
     self.jump_url_pattern = re.compile(r"https://discord\.com/channels/(\d+)/(\d+)/(\d+)")
+    self.anonid_pattern = re.compile(r"\b[0-9a-f]{6}\b")
 
     if not bot.config.getboolean('extensions', 'confessions', fallback=False):
       raise Exception("Module `confessions` must be enabled!")
 
+    self.image_cache:ImageCache | None = None
+    if path := self.config.get('image_cache', fallback=''):
+      self.image_cache = ImageCache(
+        path,
+        self.config.getint('image_cache_size', fallback=256) * 1048576,
+        self.config.getfloat('image_cache_ttl', fallback=7) * 86400
+      )
+
     self.report = app_commands.ContextMenu(
       name=app_commands.locale_str('Confession_Report', scope=self.SCOPE),
       allowed_contexts=app_commands.AppCommandContext(guild=True, private_channel=False),
@@ -49,6 +61,8 @@ class ConfessionsModeration(ConfessionCog, ControlPanelCog):
       callback=self.report_callback
     )
     bot.tree.add_command(self.report)
+    # Overrides the fallback in confessions, so unknown vetting buttons raise
+    interaction_router.register('pendingconfession_', self.on_confession_review)
 
   def controlpanel_settings(self, inter:discord.Interaction):
     # ControlPanel integration
@@ -64,6 +78,7 @@ class ConfessionsModeration(ConfessionCog, ControlPanelCog):
 
   def cog_unload(self):
     self.bot.tree.remove_command(self.report.qualified_name, type=self.report.type)
+    interaction_router.unregister('pendingconfession_', self.on_confession_review)
 
   # Context menu commands
 
@@ -108,6 +123,12 @@ class ConfessionsModeration(ConfessionCog, ControlPanelCog):
     """
     preface = self.babel(vettingchannel.guild, 'vetmessagecta', channel=data.target.mention)
     view = self.PendingConfessionView(self, data)
+    if self.image_cache and data.file:
+      # Keep a copy of the image so it doesn't need to be downloaded again when approved
+      try:
+        await self.image_cache.put(view.data, data.file.fp, data.file.filename.rsplit('.', 1)[1])
+      except OSError as e:
+        print("Failed to cache image for vetting:", e)
     success = await data.send_confession(
       inter,
       target=vettingchannel,
@@ -116,6 +137,8 @@ class ConfessionsModeration(ConfessionCog, ControlPanelCog):
       view=view
     )
 
+    if not success and self.image_cache and data.file:
+      await self.image_cache.discard(view.data)
     if success:
       await inter.followup.send(
         self.babel(inter, 'confession_vetting', channel=data.target.mention),
@@ -130,7 +153,7 @@ class ConfessionsModeration(ConfessionCog, ControlPanelCog):
       super().__init__(timeout=None)
 
       guild = pendingconfession.target.guild
-      data = pendingconfession.store()
+      self.data = data = pendingconfession.store()
       self.add_item(discord.ui.Button(
         label=parent.babel(guild, 'vetting_approve_button'),
         emoji='✅',
@@ -145,6 +168,58 @@ class ConfessionsModeration(ConfessionCog, ControlPanelCog):
         custom_id=f"pendingconfession_deny_{data}"
       ))
 
+  class BanListView(discord.ui.View):
+    """ Pages through a blocklist that's too long for one message """
+    PAGE_SIZE = 200
+    page:int = 0
+
+    def __init__(self, parent:ConfessionsModeration, origin:discord.Interaction, banlist:list[str]):
+      super().__init__(timeout=300)
+
+      self.parent = parent
+      self.origin = origin
+      self.banlist = banlist
+      self.pages = (len(banlist) - 1) // self.PAGE_SIZE + 1
+
+      self.prev_button.label = parent.babel(origin, 'channelprompt_button_prev')
+      self.next_button.label = parent.babel(origin, 'channelprompt_button_next')
+
+    def render(self) -> str:
+      """ Format the current page of the blocklist """
+      start = self.page * self.PAGE_SIZE
+      printedlist = '\n```\n' + '\n'.join(self.banlist[start:start + self.PAGE_SIZE]) + '```'
+      pager = (
+        self.parent.babel(self.origin, 'banlist_page', page=str(self.page + 1), pages=str(self.pages))
+        if self.pages > 1 else ''
+      )
+      return self.parent.babel(self.origin, 'banlist') + printedlist + pager
+
+    async def change_page(self, inter:discord.Interaction, pagediff:int):
+      """ Move forwards or backwards through the blocklist """
+      if inter.user != self.origin.user:
+        await inter.response.send_message(
+          self.parent.bot.babel(inter, 'error', 'wronguser'), ephemeral=True
+        )
+        return
+      self.page = max(0, min(self.pages - 1, self.page + pagediff))
+      self.prev_button.disabled = self.page == 0
+      self.next_button.disabled = self.page == self.pages - 1
+      await inter.response.edit_message(content=self.render(), view=self)
+
+    @discord.ui.button(disabled=True, style=discord.ButtonStyle.secondary)
+    async def prev_button(self, inter:discord.Interaction, _:discord.ui.Button):
+      await self.change_page(inter, -1)
+
+    @discord.ui.button(style=discord.ButtonStyle.secondary)
+    async def next_button(self, inter:discord.Interaction, _:discord.ui.Button):
+      await self.change_page(inter, 1)
+
+    async def on_timeout(self):
+      try:
+        await self.origin.edit_original_response(view=None)
+      except discord.HTTPException:
+        pass # Message was probably dismissed, don't worry about it
+
   class ReportView(discord.ui.View):
     """ Provides all the guidance needed before a user reports a confession """
     def __init__(
@@ -247,30 +322,55 @@ class ConfessionsModeration(ConfessionCog, ControlPanelCog):
 
   # Events
 
-  @commands.Cog.listener('on_interaction')
   async def on_confession_review(self, inter:discord.Interaction):
     """ Handle approving and denying confessions """
-    if inter.type != discord.InteractionType.component:
-      return
     assert inter.data is not None and 'custom_id' in inter.data
     custom_id = inter.data['custom_id']
-    if not custom_id.startswith('pendingconfession_'):
-      return
-    if custom_id in self.button_lock:
-      await inter.response.send_message(
-        "Somebody else has already pressed this button!", ephemeral=True
-      )
+    if custom_id.startswith('pendingconfession_approve_'):
+      accepted, datakey = True, custom_id[26:]
+    elif custom_id.startswith('pendingconfession_deny_'):
+      accepted, datakey = False, custom_id[23:]
+    else:
+      raise Exception("Unknown button action", custom_id)
+
+    # Approve and deny share a lock, so a confession can't be approved and denied at the same time
+    async with self.button_lock.hold(datakey) as held:
+      if not held:
+        await inter.response.send_message(
+          "Somebody else has already pressed this button!", ephemeral=True
+        )
+        return
+      pendingconfession = await self.review_confession(inter, datakey, accepted)
+    # The vetting message still holds the image if the review has to be retried
+    if self.image_cache:
+      await self.image_cache.discard(datakey)
+    if pendingconfession is None:
       return
 
-    self.button_lock.append(custom_id)
+    #BABEL: confession_vetting_accepted,confession_vetting_denied
+    content = self.babel(
+      pendingconfession.author,
+      'confession_vetting_accepted' if accepted else 'confession_vetting_denied',
+      channel=f"<#{pendingconfession.target.id}>"
+    )
+    if str(pendingconfession.author.id) not in self.config.get('dm_notifications', '').split(','):
+      try:
+        if not pendingconfession.author.dm_channel:
+          await pendingconfession.author.create_dm()
+        await pendingconfession.author.send(content)
+      except discord.Forbidden:
+        pass
+
+  async def review_confession(
+    self, inter:discord.Interaction, datakey:str, accepted:bool
+  ) -> Optional[ConfessionData]:
+    """ Send or reject a confession from vetting, returns the confession if it was reviewed """
     await inter.response.defer()
-    accepted = False
     assert inter.message is not None and inter.guild is not None
     try:
-      if custom_id.startswith('pendingconfession_approve_'):
-        accepted = True
-        pendingconfession = ConfessionData(self)
-        await pendingconfession.from_binary(self.crypto, custom_id[26:])
+      pendingconfession = ConfessionData(self)
+      await pendingconfession.from_binary(self.crypto, datakey)
+      if accepted:
         pendingconfession.set_content(embed=inter.message.embeds[0])
         if pendingconfession.reference is None:
           # Try and recover reference if it's lost
@@ -280,64 +380,40 @@ class ConfessionsModeration(ConfessionCog, ControlPanelCog):
             assert isinstance(channel, (discord.TextChannel, discord.Thread))
             reference = channel.get_partial_message(message_id)
             pendingconfession.reference = reference
-      elif custom_id.startswith('pendingconfession_deny_'):
-        pendingconfession = ConfessionData(self)
-        await pendingconfession.from_binary(self.crypto, custom_id[23:])
-      else:
-        self.button_lock.remove(custom_id)
-        raise Exception("Unknown button action", custom_id)
     except CorruptConfessionDataException:
       await inter.followup.send(self.babel(inter, 'vetcorrupt'))
-      self.button_lock.remove(custom_id)
-      return
+      return None
     except (discord.NotFound, discord.Forbidden):
       if accepted:
         await inter.followup.send(self.babel(inter, 'vettingrequiredmissing'))
-      self.button_lock.remove(custom_id)
-      return
+      return None
 
     if accepted:
-      try:
-        if inter.message.embeds[0].image.url:
-          await pendingconfession.add_image(url=inter.message.embeds[0].image.url)
-        elif (
-          len(inter.message.attachments) and
-          inter.message.attachments[0].content_type is not None and
-          inter.message.attachments[0].content_type.startswith('image')
-        ):
-          await pendingconfession.add_image(attachment=inter.message.attachments[0])
-        if not await pendingconfession.send_confession(inter, perform_checks=False):
-          self.button_lock.remove(custom_id)
-          return
-      except Exception as e:
-        self.button_lock.remove(custom_id)
-        raise e
+      cached = await self.image_cache.get(datakey) if self.image_cache else None
+      downloaded = True
+      if cached:
+        pendingconfession.set_image(*cached)
+      elif inter.message.embeds[0].image.url:
+        downloaded = await pendingconfession.add_image(url=inter.message.embeds[0].image.url)
+      elif (
+        len(inter.message.attachments) and
+        inter.message.attachments[0].content_type is not None and
+        inter.message.attachments[0].content_type.startswith('image')
+      ):
+        downloaded = await pendingconfession.add_image(attachment=inter.message.attachments[0])
+      if not downloaded:
+        await inter.followup.send(self.babel(inter, 'vettingimagemissing'))
+        return None
+      if not await pendingconfession.send_confession(inter, perform_checks=False):
+        return None
 
     metadata = {'user':inter.user.mention, 'channel':pendingconfession.target.mention}
     if accepted:
       msg = self.babel(inter.guild, 'vetaccepted', **metadata)
     else:
       msg = self.babel(inter.guild, 'vetdenied', **metadata)
-    try:
-      await inter.message.edit(content=msg, view=None)
-    except Exception as e:
-      self.button_lock.remove(custom_id)
-      raise e
-    self.button_lock.remove(custom_id)
-
-    #BABEL: confession_vetting_accepted,confession_vetting_denied
-    content = self.babel(
-      pendingconfession.author,
-      'confession_vetting_accepted' if accepted else 'confession_vetting_denied',
-      channel=f"<#{pendingconfession.target.id}>"
-    )
-    if str(pendingconfession.author.id) not in self.config.get('dm_notifications', '').split(','):
-      try:
-        if not pendingconfession.author.dm_channel:
-          await pendingconfession.author.create_dm()
-        await pendingconfession.author.send(content)
-      except discord.Forbidden:
-        pass
+    await inter.message.edit(content=msg, view=None)
+    return pendingconfession
 
   # Commands
 
@@ -347,7 +423,8 @@ class ConfessionsModeration(ConfessionCog, ControlPanelCog):
   )
   @app_commands.describe(
     anonid=app_commands.locale_str('block_anonid_desc', scope=SCOPE),
-    unblock=app_commands.locale_str('block_unblock_desc', scope=SCOPE)
+    unblock=app_commands.locale_str('block_unblock_desc', scope=SCOPE),
+    blocklist=app_commands.locale_str('block_blocklist_desc', scope=SCOPE)
   )
   @app_commands.allowed_contexts(guilds=True, private_channels=False)
   @app_commands.default_permissions(moderate_members=True)
@@ -355,45 +432,71 @@ class ConfessionsModeration(ConfessionCog, ControlPanelCog):
     self,
     inter:discord.Interaction,
     anonid:Optional[app_commands.Range[str, 6, 6]] = None,
-    unblock:Optional[bool] = False
+    unblock:Optional[bool] = False,
+    blocklist:Optional[discord.Attachment] = None
   ):
     """
       Block or unblock anon-ids from confessing
     """
     assert inter.guild is not None
-    banlist_raw = self.config.get(f'{inter.guild.id}_banned', fallback='')
-    banlist = banlist_raw.split(',')
+    if blocklist is not None:
+      await self.import_blocklist(inter, blocklist, bool(unblock))
+      return
+
     if anonid is None:
-      if not banlist_raw:
+      banlist = sorted(self.store.bans(inter.guild.id))
+      if not banlist:
         await inter.response.send_message(self.babel(inter, 'emptybanlist'))
         return
-      printedlist = '\n```\n' + ('\n'.join(banlist)) + '```'
-      await inter.response.send_message(self.babel(inter, 'banlist') + printedlist)
+      view = self.BanListView(self, inter, banlist)
+      kwargs = {'view': view} if view.pages > 1 else {}
+      await inter.response.send_message(
+        view.render(),
+        file=discord.File(io.BytesIO('\n'.join(banlist).encode()), 'blocklist.txt'),
+        **kwargs
+      )
       return
 
     anonid = anonid.lower()
-    try:
-      int(anonid, 16)
-    except ValueError:
+    if not self.anonid_pattern.fullmatch(anonid):
       await inter.response.send_message(self.babel(inter, 'invalidanonid'))
       return
-    if anonid in banlist and not unblock:
+
+    if unblock:
+      if not self.store.remove_bans(inter.guild.id, [anonid]):
+        await inter.response.send_message(self.babel(inter, 'nomatchanonid'))
+        return
+    elif not self.store.add_bans(inter.guild.id, [anonid]):
       await inter.response.send_message(self.babel(inter, 'doublebananonid'))
       return
-    #BABEL: nomatchanonid
-    #TODO: keeping this string around in case a new way to check is found
-    # will probably involve storing / retreiving recent anon-ids
+    self.store.save()
+
+    #BABEL: unbansuccess,bansuccess
+    await inter.response.send_message(
+      self.babel(inter, ('un' if unblock else '')+'bansuccess', user=anonid)
+    )
+
+  async def import_blocklist(
+    self, inter:discord.Interaction, blocklist:discord.Attachment, unblock:bool
+  ):
+    """ Block or unblock every anon-id found in an uploaded text file """
+    assert inter.guild is not None
+    anonids = set()
+    if blocklist.size <= self.BLOCKLIST_MAX_SIZE:
+      text = (await blocklist.read()).decode('utf-8', errors='ignore').lower()
+      anonids = set(self.anonid_pattern.findall(text))
+    if not anonids:
+      await inter.response.send_message(self.babel(inter, 'banimport_invalid'), ephemeral=True)
+      return
 
     if unblock:
-      fullid = [i for i in banlist if anonid in i][0]
-      self.config[str(inter.guild.id)+'_banned'] = banlist_raw.replace(fullid+',','')
+      changed = self.store.remove_bans(inter.guild.id, anonids)
     else:
-      self.config[str(inter.guild.id)+'_banned'] = banlist_raw + anonid + ','
-    self.bot.config.save()
+      changed = self.store.add_bans(inter.guild.id, anonids)
+    self.store.save()
 
-    #BABEL: unbansuccess,bansuccess
     await inter.response.send_message(
-      self.babel(inter, ('un' if unblock else '')+'bansuccess', user=anonid)
+      self.babel(inter, 'banimport_success', count=str(len(changed)), unblock=unblock)
     )
 
 
@@ -14,8 +14,9 @@ from discord.ext import commands
 
 from extensions.controlpanel import ControlPanelCog, Toggleable, Stringable, Listable
 from .confessions_common import (
-  ConfessionCog, Confessable, ChannelType, ChannelSelectView, get_channeltypes, findvettingchannel,
-  get_guildchannels, set_guildchannels
+  ConfessionCog, Confessable, ChannelType, ChannelSelectView, get_channeltypes,
+  get_guildchannels, set_guildchannels, get_channeltype, get_vettingchannel, anonid_cache,
+  webhook_cache, resolver, forget_guild
 )
 
 if TYPE_CHECKING:
@@ -53,7 +54,8 @@ class ConfessionsSetup(ConfessionCog, ControlPanelCog):
         Toggleable(self.SCOPE, f'{inter.guild_id}_imagesupport', 'image_support', default=True),
         Toggleable(self.SCOPE, f'{inter.guild_id}_webhook', 'enable_webhooks', default=False),
         Stringable(self.SCOPE, f'{inter.guild_id}_preface', 'confession_preface'),
-        Stringable(self.SCOPE, f'{inter.guild_id}_confessname', 'confess_custom_name', r'\p{L}{1,32}')
+        Stringable(self.SCOPE, f'{inter.guild_id}_confessname', 'confess_custom_name', r'\p{L}{1,32}'),
+        Listable(self.SCOPE, f'{inter.guild_id}_digest', 'digest_mode', str(inter.channel_id))
         #TODO: Add custom pfp stringable, Anon-ID usernames, Anon-Colour pfps
       ]
     return out
@@ -110,10 +112,7 @@ class ConfessionsSetup(ConfessionCog, ControlPanelCog):
         self.current_channel = channel.parent
       else:
         self.current_channel = channel
-      guildchannels = get_guildchannels(parent.config, inter.guild.id)
-      self.current_mode = guildchannels.get(
-        self.current_channel.id, ChannelType.unset
-      )
+      self.current_mode = get_channeltype(parent.config, self.current_channel.id)
       self.update_state()
 
     def regenerate_matches(
@@ -149,7 +148,7 @@ class ConfessionsSetup(ConfessionCog, ControlPanelCog):
       self, inter:discord.Interaction, channel:discord.TextChannel, mode:ChannelType
     ) -> bool:
       """ Tries to change settings as requested and handles all rules and requirements """
-      guildchannels = get_guildchannels(self.parent.config, channel.guild.id)
+      guildchannels = dict(get_guildchannels(self.parent.config, channel.guild.id))
       old_mode = guildchannels.get(channel.id, ChannelType.unset)
       if mode == ChannelType.unset:
         if old_mode == ChannelType.unset:
@@ -160,7 +159,7 @@ class ConfessionsSetup(ConfessionCog, ControlPanelCog):
         if 'ConfessionsModeration' not in self.parent.bot.cogs:
           await inter.response.send_message(self.parent.babel(inter, 'no_moderation'), ephemeral=True)
           return False
-        if findvettingchannel(guildchannels):
+        if get_vettingchannel(self.parent.config, channel.guild.id):
           await inter.response.send_message(self.parent.babel(inter, 'singlechannel'), ephemeral=True)
           return False
       if old_mode == mode:
@@ -169,7 +168,7 @@ class ConfessionsSetup(ConfessionCog, ControlPanelCog):
       if mode != ChannelType.unset:
         guildchannels[channel.id] = mode
       set_guildchannels(self.parent.config, channel.guild.id, guildchannels)
-      self.parent.bot.config.save()
+      self.parent.store.save()
 
       #BABEL: setsuccess#,unsetsuccess#
       modestring = (
@@ -198,6 +197,16 @@ class ConfessionsSetup(ConfessionCog, ControlPanelCog):
       self.update_list()
       self.update_state()
       await self.update_message(inter)
+
+      # Look up the webhook now so the first confession doesn't have to
+      if (
+        mode not in (ChannelType.unset, ChannelType.vetting) and
+        self.parent.store.getboolean(channel.guild.id, 'webhook', fallback=False)
+      ):
+        try:
+          await webhook_cache.load(self.parent.bot, channel)
+        except discord.HTTPException:
+          pass # Missing permissions will be reported when sending instead
       return True
 
     def update_state(self):
@@ -247,11 +256,10 @@ class ConfessionsSetup(ConfessionCog, ControlPanelCog):
         return
       self.send_button.disabled = False
       channel_id = int(self.channel_selector.values[0])
-      try:
-        channel = await self.parent.bot.fetch_channel(channel_id)
-        assert isinstance(channel, discord.TextChannel)
+      channel = await resolver.target(self.parent.bot, channel_id, interaction.guild)
+      if isinstance(channel, discord.TextChannel):
         self.current_channel = channel
-      except discord.Forbidden:
+      else:
         self.current_mode = ChannelType.unset
         self.update_state()
         await self.update_message(interaction)
@@ -260,8 +268,7 @@ class ConfessionsSetup(ConfessionCog, ControlPanelCog):
           ephemeral=True
         )
         return
-      guildchannels = get_guildchannels(self.parent.config, self.current_channel.guild.id)
-      self.current_mode = guildchannels.get(self.current_channel.id, ChannelType.unset)
+      self.current_mode = get_channeltype(self.parent.config, self.current_channel.id)
       self.update_state()
       await self.update_message(interaction)
 
@@ -314,7 +321,7 @@ class ConfessionsSetup(ConfessionCog, ControlPanelCog):
     async def continue_button(self, inter:discord.Interaction, _:discord.ui.Button):
       """ On click of continue button """
       assert inter.guild is not None
-      self.parent.config.pop(str(inter.guild.id)+'_banned')
+      self.parent.store.clear_bans(inter.guild.id)
       self.parent.perform_shuffle(inter.guild.id)
       await inter.response.send_message(self.parent.babel(inter, 'shufflesuccess'))
       await self.origin.delete_original_response()
@@ -334,52 +341,49 @@ class ConfessionsSetup(ConfessionCog, ControlPanelCog):
 
     if self.bot.verbose:
       print("Starting lost guild search")
-    removed = []
-    for key in self.config:
-      guild_id = key.split('_')[0]
-      if guild_id.isdigit():
-        guild = self.bot.get_guild(int(guild_id))
-        # Remove config for any guilds the bot can't access
-        if guild is None:
-          self.config.pop(key)
-          if not self.bot.quiet and guild_id not in removed:
-            print("Removed guild", guild_id, "from config.")
-          removed.append(guild_id)
-        # Remove config for any channels the bot can't access
-        elif key.endswith('_channels'):
-          guildchannels = get_guildchannels(self.config, guild.id)
-          for channel_id in list(guildchannels):
-            if guild.get_channel(channel_id) is None:
-              guildchannels.pop(channel_id)
-              if not self.bot.quiet:
-                print("Removed channel", channel_id, "from guild", guild_id, "config.")
-          set_guildchannels(self.config, guild.id, guildchannels)
-
-    self.bot.config.save()
+    for guild_id in self.store.guild_ids():
+      guild = self.bot.get_guild(guild_id)
+      # Remove config for any guilds the bot can't access
+      if guild is None:
+        self.store.drop(guild_id)
+        forget_guild(guild_id)
+        if not self.bot.quiet:
+          print("Removed guild", guild_id, "from config.")
+        continue
+      # Remove config for any channels the bot can't access
+      guildchannels = dict(get_guildchannels(self.config, guild.id))
+      if not guildchannels:
+        continue
+      for channel_id in list(guildchannels):
+        if guild.get_channel(channel_id) is None:
+          guildchannels.pop(channel_id)
+          if not self.bot.quiet:
+            print("Removed channel", channel_id, "from guild", guild_id, "config.")
+      set_guildchannels(self.config, guild.id, guildchannels)
+
+    self.store.save()
     if self.bot.verbose:
       print("Completed lost guild search")
 
   @commands.Cog.listener('on_guild_remove')
   async def guild_cleanup(self, guild:discord.Guild):
     """ Automatically remove data related to a guild on removal """
-    removed = False
-    for key in list(k for k in self.config if k.startswith(str(guild.id)+'_')):
-      self.config.pop(key)
-      removed = True
-    self.bot.config.save()
+    removed = self.store.drop(guild.id)
+    forget_guild(guild.id)
+    self.store.save()
     if removed and not self.bot.quiet:
       print("Removed guild", guild.id, "from config.")
 
   @commands.Cog.listener('on_guild_channel_delete')
   async def channel_cleanup(self, channel:discord.TextChannel):
     """ Automatically remove data related to a channel on delete """
-    guildchannels = get_guildchannels(self.config, channel.guild.id)
+    guildchannels = dict(get_guildchannels(self.config, channel.guild.id))
     if channel.id in guildchannels:
       guildchannels.pop(channel.id)
       if not self.bot.quiet:
         print("Removed channel", channel.id, "from guild", channel.guild.id, "config.")
       set_guildchannels(self.config, channel.guild.id, guildchannels)
-    self.bot.config.save()
+      self.store.save()
 
   # Commands
 
@@ -412,7 +416,7 @@ class ConfessionsSetup(ConfessionCog, ControlPanelCog):
       Change all anon-ids on a server
     """
     assert inter.guild is not None
-    if str(inter.guild.id)+'_banned' in self.config:
+    if self.store.bans(inter.guild.id):
       await inter.response.send_message(
         self.babel(inter, 'shufflebanresetwarning'),
         view=self.BanResetView(self, inter),
@@ -426,8 +430,9 @@ class ConfessionsSetup(ConfessionCog, ControlPanelCog):
   def perform_shuffle(self, guild_id:int):
     cog = cast(ConfessionCog, self.bot.cogs['Confessions'])
     salt = cog.crypto.srandom_token()
-    self.bot.config.set(self.SCOPE, str(guild_id) + '_shuffle', b64encode(salt).decode('ascii'))
-    self.bot.config.save()
+    self.store.set(guild_id, 'shuffle', b64encode(salt).decode('ascii'))
+    anonid_cache.forget(guild_id)
+    self.store.save()
 
 
 async def setup(bot:MerelyBot):
@@ -0,0 +1,415 @@
+"""
+  Confessions Storage - Backends for per-guild confession state
+  Note: Do not enable as an extension, code in here is used implicitly
+  To reload, reload each of the enabled confessions modules
+"""
+from __future__ import annotations
+
+import asyncio, io, os, sqlite3, time
+from typing import Optional, Iterable, Iterator, TYPE_CHECKING
+
+if TYPE_CHECKING:
+  from configparser import ConfigParser, SectionProxy
+
+
+# Keys which are edited by ControlPanel are read and written by the framework directly,
+#  so only keys owned by the confessions modules can be moved to SQLite
+SQLITE_KEYS = ('channels', 'banned', 'shuffle')
+
+
+class ConfigSaver:
+  """
+    Write-behind saver for config.ini
+
+    Saves requested within `delay` seconds of each other are merged into one flush.
+    The config is serialized on the event loop and written to a temporary file by a worker thread,
+    then renamed over config.ini, so a crash can never leave a half-written config.
+  """
+  flushes:int = 0
+  requests:int = 0
+  last_latency:float = 0.0
+  total_latency:float = 0.0
+
+  def __init__(self, config:ConfigParser, path:str, delay:float):
+    self.config = config
+    self.path = path
+    self.delay = delay
+    # The flush which is still waiting out the delay, and every flush which hasn't finished
+    self._waiting:asyncio.Task | None = None
+    self._tasks:set[asyncio.Task] = set()
+    self._lock = asyncio.Lock()
+
+  def request(self):
+    """ Schedule a flush, merging with any flush that is already waiting """
+    self.requests += 1
+    if self._waiting is None:
+      self._waiting = asyncio.get_running_loop().create_task(self._delayed_flush())
+      self._tasks.add(self._waiting)
+      self._waiting.add_done_callback(self._tasks.discard)
+
+  async def _delayed_flush(self):
+    await asyncio.sleep(self.delay)
+    # Any requests from here on need another flush
+    self._waiting = None
+    await self.flush()
+
+  async def flush(self):
+    """ Write the config to disk immediately """
+    async with self._lock:
+      start = time.perf_counter()
+      data = self._serialize()
+      while True:
+        tmp = await asyncio.to_thread(self._write, data)
+        # The framework saves config.ini synchronously on the event loop, so nothing can write to it
+        #  between this check and the rename. If the config changed during the write, it may have been
+        #  saved since, so the newer copy is written instead of replacing that save with a stale one
+        latest = self._serialize()
+        if latest == data:
+          os.replace(tmp, self.path)
+          break
+        data = latest
+      self.flushes += 1
+      self.last_latency = time.perf_counter() - start
+      self.total_latency += self.last_latency
+
+  def _serialize(self) -> str:
+    buffer = io.StringIO()
+    self.config.write(buffer)
+    return buffer.getvalue()
+
+  def _write(self, data:str) -> str:
+    tmp = self.path + '.tmp'
+    with open(tmp, 'w', encoding='utf-8') as f:
+      f.write(data)
+      f.flush()
+      os.fsync(f.fileno())
+    return tmp
+
+  async def close(self):
+    """ Flush any pending changes and wait for writes in progress before shutdown """
+    pending = self._waiting is not None
+    if self._waiting is not None:
+      self._waiting.cancel()
+      self._waiting = None
+    if self._tasks:
+      await asyncio.gather(*self._tasks, return_exceptions=True)
+    if pending:
+      await self.flush()
+
+  def stats(self) -> dict[str, float]:
+    """ Flush counts and latency for monitoring """
+    return {
+      'requests': self.requests,
+      'flushes': self.flushes,
+      'last_latency': self.last_latency,
+      'avg_latency': self.total_latency / self.flushes if self.flushes else 0.0
+    }
+
+
+class ReferenceStore:
+  """
+    Remembers which channel each replied-to message is in, while the reply waits in vetting
+
+    Pending confessions only have room for the id of the message they reply to, so the channel is
+    stored here, in SQLite so replies survive a restart. References expire once vetting would have,
+    and each guild keeps at most `maxsize`, dropping the oldest first.
+  """
+  PRUNE_INTERVAL = 3600
+
+  def __init__(self, path:str, ttl:float, maxsize:int):
+    self.ttl = ttl
+    self.maxsize = maxsize
+    self.pruned = 0.0
+    self.db = sqlite3.connect(path, isolation_level=None)
+    self.db.execute('PRAGMA journal_mode=WAL')
+    self.db.execute('PRAGMA synchronous=NORMAL')
+    self.db.execute(
+      'CREATE TABLE IF NOT EXISTS refs ('
+      'message_id INTEGER PRIMARY KEY, guild_id INTEGER NOT NULL, channel_id INTEGER NOT NULL, '
+      'created REAL NOT NULL)'
+    )
+    self.db.execute('CREATE INDEX IF NOT EXISTS refs_guild ON refs (guild_id, created)')
+
+  def put(self, guild_id:int, channel_id:int, message_id:int):
+    """ Remember the channel of a replied-to message """
+    now = time.time()
+    with self.db:
+      self.db.execute('BEGIN')
+      self.db.execute(
+        'INSERT OR REPLACE INTO refs (message_id, guild_id, channel_id, created) VALUES (?, ?, ?, ?)',
+        (message_id, guild_id, channel_id, now)
+      )
+      self.db.execute(
+        'DELETE FROM refs WHERE guild_id = ? AND message_id IN ('
+        'SELECT message_id FROM refs WHERE guild_id = ? ORDER BY created DESC LIMIT -1 OFFSET ?)',
+        (guild_id, guild_id, self.maxsize)
+      )
+      if now - self.pruned > self.PRUNE_INTERVAL:
+        self.db.execute('DELETE FROM refs WHERE created < ?', (now - self.ttl,))
+        self.pruned = now
+
+  def get(self, guild_id:int, message_id:int) -> Optional[int]:
+    """ Returns the channel id of a replied-to message, if it's still remembered """
+    row = self.db.execute(
+      'SELECT channel_id FROM refs WHERE message_id = ? AND guild_id = ? AND created >= ?',
+      (message_id, guild_id, time.time() - self.ttl)
+    ).fetchone()
+    return row[0] if row else None
+
+  def drop(self, guild_id:int):
+    """ Forget every reference for a guild """
+    self.db.execute('DELETE FROM refs WHERE guild_id = ?', (guild_id,))
+
+  def close(self):
+    self.db.close()
+
+
+class GuildStore:
+  """ Stores per-guild state as `{guild_id}_{key}` entries in the [confessions] config section """
+  def __init__(self, config:SectionProxy):
+    self.config = config
+    self.dirty = False
+    self._bans:dict[int, set[str]] = {}
+    self.saver = ConfigSaver(
+      config.parser,
+      config.parser.path + 'config.ini', # type: ignore[attr-defined]
+      config.getfloat('save_delay', fallback=5.0)
+    )
+    self.references = ReferenceStore(
+      config.get('reference_database', fallback='') or ':memory:',
+      config.getfloat('reference_ttl', fallback=7) * 86400,
+      config.getint('reference_limit', fallback=1000)
+    )
+
+  def get(self, guild_id:int, key:str, fallback:Optional[str] = None) -> Optional[str]:
+    """ Returns the value of a guild setting """
+    return self.config.get(f'{guild_id}_{key}', fallback=fallback)
+
+  def getboolean(self, guild_id:int, key:str, fallback:bool) -> bool:
+    """ Returns the value of a guild setting as a boolean """
+    return self.config.getboolean(f'{guild_id}_{key}', fallback=fallback)
+
+  def set(self, guild_id:int, key:str, value:str):
+    """ Changes the value of a guild setting """
+    self.config[f'{guild_id}_{key}'] = value
+    self.dirty = True
+
+  def pop(self, guild_id:int, key:str):
+    """ Removes a guild setting, if it exists """
+    if self.config.pop(f'{guild_id}_{key}', None) is not None:
+      self.dirty = True
+
+  def items(self, key:str) -> Iterator[tuple[int, str]]:
+    """ Yields (guild_id, value) for every guild which has this setting """
+    for configkey in list(self.config):
+      guild_id, _, suffix = configkey.partition('_')
+      if suffix == key and guild_id.isdigit():
+        yield int(guild_id), self.config[configkey]
+
+  def guild_ids(self) -> set[int]:
+    """ Returns every guild which has any stored settings """
+    return set(int(k.split('_')[0]) for k in self.config if k.split('_')[0].isdigit())
+
+  def bans(self, guild_id:int) -> set[str]:
+    """ Returns the set of blocked anon-ids for a guild, this must not be modified """
+    if guild_id not in self._bans:
+      self._bans[guild_id] = self._load_bans(guild_id)
+    return self._bans[guild_id]
+
+  def add_bans(self, guild_id:int, anonids:Iterable[str]) -> set[str]:
+    """ Block anon-ids on a guild, returns the ones which weren't already blocked """
+    bans = self.bans(guild_id)
+    added = set(anonids) - bans
+    if added:
+      bans |= added
+      self._save_bans(guild_id, added, set())
+    return added
+
+  def remove_bans(self, guild_id:int, anonids:Iterable[str]) -> set[str]:
+    """ Unblock anon-ids on a guild, returns the ones which were blocked """
+    bans = self.bans(guild_id)
+    removed = set(anonids) & bans
+    if removed:
+      bans -= removed
+      self._save_bans(guild_id, set(), removed)
+    return removed
+
+  def clear_bans(self, guild_id:int):
+    """ Unblock everyone on a guild """
+    self.remove_bans(guild_id, set(self.bans(guild_id)))
+
+  def _load_bans(self, guild_id:int) -> set[str]:
+    # Older versions left a trailing comma
+    return set(b for b in (self.get(guild_id, 'banned') or '').split(',') if b)
+
+  def _save_bans(self, guild_id:int, added:set[str], removed:set[str]):
+    bans = self._bans[guild_id]
+    if bans:
+      self.set(guild_id, 'banned', ','.join(sorted(bans)))
+    else:
+      self.pop(guild_id, 'banned')
+
+  def drop(self, guild_id:int) -> bool:
+    """ Removes all settings for a guild, returns True if anything was removed """
+    self._bans.pop(guild_id, None)
+    self.references.drop(guild_id)
+    removed = False
+    for key in list(k for k in self.config if k.startswith(str(guild_id)+'_')):
+      self.config.pop(key)
+      removed = True
+    self.dirty = self.dirty or removed
+    return removed
+
+  def save(self):
+    """ Persist any changes made to the config, after a short delay """
+    if self.dirty:
+      self.dirty = False
+      self.saver.request()
+
+  async def close(self):
+    """ Release any resources held by this store """
+    self.save()
+    await self.saver.close()
+    self.references.close()
+
+
+class SqliteGuildStore(GuildStore):
+  """
+    Stores per-guild state in an SQLite database running in WAL mode
+
+    Only SQLITE_KEYS are stored in the database, everything else falls back to the config.
+    Blocked anon-ids get a table of their own, so a block or unblock only touches one row.
+    Writes are committed immediately, so they don't require the config to be rewritten.
+  """
+  def __init__(self, config:SectionProxy, path:str):
+    super().__init__(config)
+    self.db = sqlite3.connect(path, isolation_level=None)
+    self.db.execute('PRAGMA journal_mode=WAL')
+    self.db.execute('PRAGMA synchronous=NORMAL')
+    self.db.execute(
+      'CREATE TABLE IF NOT EXISTS guild_data ('
+      'guild_id INTEGER NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL, '
+      'PRIMARY KEY (guild_id, key)) WITHOUT ROWID'
+    )
+    self.db.execute('CREATE INDEX IF NOT EXISTS guild_data_key ON guild_data (key)')
+    self.db.execute(
+      'CREATE TABLE IF NOT EXISTS bans ('
+      'guild_id INTEGER NOT NULL, anonid TEXT NOT NULL, '
+      'PRIMARY KEY (guild_id, anonid)) WITHOUT ROWID'
+    )
+
+  def import_config(self) -> int:
+    """ Move any SQLITE_KEYS still in the config into the database, returns the number moved """
+    moved = []
+    for configkey in list(self.config):
+      guild_id, _, key = configkey.partition('_')
+      if key in SQLITE_KEYS and guild_id.isdigit():
+        moved.append((int(guild_id), key, self.config[configkey]))
+    if not moved:
+      return 0
+    with self.db:
+      self.db.execute('BEGIN')
+      self.db.executemany(
+        'INSERT OR REPLACE INTO guild_data (guild_id, key, value) VALUES (?, ?, ?)',
+        (m for m in moved if m[1] != 'banned')
+      )
+      self.db.executemany(
+        'INSERT OR IGNORE INTO bans (guild_id, anonid) VALUES (?, ?)',
+        ((m[0], anonid) for m in moved if m[1] == 'banned' for anonid in m[2].split(',') if anonid)
+      )
+    for guild_id, key, _ in moved:
+      self.config.pop(f'{guild_id}_{key}')
+    self.dirty = True
+    return len(moved)
+
+  def get(self, guild_id:int, key:str, fallback:Optional[str] = None) -> Optional[str]:
+    if key not in SQLITE_KEYS:
+      return super().get(guild_id, key, fallback)
+    row = self.db.execute(
+      'SELECT value FROM guild_data WHERE guild_id = ? AND key = ?', (guild_id, key)
+    ).fetchone()
+    return row[0] if row else fallback
+
+  def set(self, guild_id:int, key:str, value:str):
+    if key not in SQLITE_KEYS:
+      return super().set(guild_id, key, value)
+    self.db.execute(
+      'INSERT OR REPLACE INTO guild_data (guild_id, key, value) VALUES (?, ?, ?)',
+      (guild_id, key, value)
+    )
+
+  def pop(self, guild_id:int, key:str):
+    if key not in SQLITE_KEYS:
+      return super().pop(guild_id, key)
+    self.db.execute('DELETE FROM guild_data WHERE guild_id = ? AND key = ?', (guild_id, key))
+
+  def items(self, key:str) -> Iterator[tuple[int, str]]:
+    if key not in SQLITE_KEYS:
+      yield from super().items(key)
+      return
+    yield from self.db.execute(
+      'SELECT guild_id, value FROM guild_data WHERE key = ?', (key,)
+    ).fetchall()
+
+  def guild_ids(self) -> set[int]:
+    return super().guild_ids() | set(r[0] for r in self.db.execute(
+      'SELECT guild_id FROM guild_data UNION SELECT guild_id FROM bans'
+    ))
+
+  def _load_bans(self, guild_id:int) -> set[str]:
+    return set(r[0] for r in self.db.execute('SELECT anonid FROM bans WHERE guild_id = ?', (guild_id,)))
+
+  def _save_bans(self, guild_id:int, added:set[str], removed:set[str]):
+    with self.db:
+      self.db.execute('BEGIN')
+      self.db.executemany(
+        'INSERT OR IGNORE INTO bans (guild_id, anonid) VALUES (?, ?)', ((guild_id, a) for a in added)
+      )
+      self.db.executemany(
+        'DELETE FROM bans WHERE guild_id = ? AND anonid = ?', ((guild_id, r) for r in removed)
+      )
+
+  def drop(self, guild_id:int) -> bool:
+    removed = super().drop(guild_id)
+    with self.db:
+      self.db.execute('BEGIN')
+      cursor = self.db.execute('DELETE FROM guild_data WHERE guild_id = ?', (guild_id,))
+      removed = removed or cursor.rowcount > 0
+      cursor = self.db.execute('DELETE FROM bans WHERE guild_id = ?', (guild_id,))
+    return removed or cursor.rowcount > 0
+
+  async def close(self):
+    await super().close()
+    self.db.close()
+
+
+_store:GuildStore | None = None
+
+
+def get_guildstore(config:SectionProxy) -> GuildStore:
+  """
+    Returns the active GuildStore, opening it if needed
+    Set `database` in [confessions] to use SQLite instead of config.ini
+  """
+  global _store
+  if _store is None:
+    if path := config.get('database', fallback=''):
+      sqlitestore = SqliteGuildStore(config, path)
+      sqlitestore.import_config()
+      _store = sqlitestore
+    else:
+      _store = GuildStore(config)
+  return _store
+
+
+async def close_guildstore():
+  """ Closes the active GuildStore, the next call to get_guildstore() will reopen it """
+  global _store
+  if _store is not None:
+    store, _store = _store, None
+    await store.close()
+
+
+async def setup(_):
+  """ Refuse to bind this cog to the bot """
+  raise Exception("This module is not meant to be imported as an extension!")
@@ -0,0 +1,28 @@
+"""
+  This script moves per-guild channels, bans and shuffles into an SQLite database
+  Only runs if `database` is set in [confessions]
+"""
+
+from __future__ import annotations
+
+import asyncio
+from typing import TYPE_CHECKING
+
+from extensions.confessions_storage import SqliteGuildStore
+
+if TYPE_CHECKING:
+  from config import Config
+
+
+def migrate(config:Config):
+  path = config['confessions'].get('database', fallback='')
+  if not path:
+    print(" - No database set in [confessions], per-guild data will stay in config.ini.")
+    return
+  print(" - Moving per-guild data from config.ini to " + path + "...")
+
+  store = SqliteGuildStore(config['confessions'], path)
+  moved = store.import_config()
+  asyncio.run(store.close())
+
+  print(f" - Moved {moved} entries, SQLite migration complete!")
@@ -0,0 +1,175 @@
+"""
+  Tests for the caches and registries in confessions_common
+  Usage: python3 -m pytest tests
+"""
+
+import asyncio
+
+import pytest
+
+from extensions import confessions_common
+from extensions.confessions_common import AnonIdCache, InteractionRouter, LockRegistry, RateLimiter
+
+
+@pytest.fixture
+def clock(monkeypatch:pytest.MonkeyPatch) -> list[float]:
+  """ Replaces time.monotonic with a clock which only moves when the test moves it """
+  now = [1000.0]
+  monkeypatch.setattr(confessions_common.time, 'monotonic', lambda: now[0])
+  return now
+
+
+# AnonIdCache
+
+def test_anonid_hit_and_miss():
+  cache = AnonIdCache()
+  assert cache.get(1, 2) is None
+  cache.put(1, 2, 'abcdef')
+  assert cache.get(1, 2) == 'abcdef'
+  assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_anonid_evicts_least_recently_used(monkeypatch:pytest.MonkeyPatch):
+  monkeypatch.setattr(AnonIdCache, 'MAXSIZE', 2)
+  cache = AnonIdCache()
+  cache.put(1, 1, 'aaaaaa')
+  cache.put(1, 2, 'bbbbbb')
+  cache.get(1, 1)
+  cache.put(1, 3, 'cccccc')
+  assert cache.get(1, 2) is None
+  assert cache.get(1, 1) == 'aaaaaa'
+  assert cache.get(1, 3) == 'cccccc'
+
+
+def test_anonid_forget_guild():
+  cache = AnonIdCache()
+  cache.salts[1] = b'salt'
+  cache.put(1, 1, 'aaaaaa')
+  cache.put(2, 1, 'bbbbbb')
+  cache.forget(1)
+  assert 1 not in cache.salts
+  assert cache.get(1, 1) is None
+  assert cache.get(2, 1) == 'bbbbbb'
+
+
+# RateLimiter
+
+def test_ratelimit_parse():
+  assert RateLimiter.parse('5/60') == (5, 60.0)
+  assert RateLimiter.parse('0/60') is None
+  assert RateLimiter.parse('5/') is None
+  assert RateLimiter.parse('') is None
+  assert RateLimiter.parse(None) is None
+
+
+def test_ratelimit_refills(clock:list[float]):
+  limiter = RateLimiter()
+  limits = [(('user', 1, 1), (2, 10.0))]
+  assert limiter.acquire(limits) == 0
+  assert limiter.acquire(limits) == 0
+  # One token refills every 5 seconds
+  assert limiter.acquire(limits) == pytest.approx(5.0)
+  clock[0] += 2
+  assert limiter.acquire(limits) == pytest.approx(3.0)
+  clock[0] += 3
+  assert limiter.acquire(limits) == 0
+  assert limiter.rejected == 2
+
+
+def test_ratelimit_spends_all_buckets_or_none(clock:list[float]):
+  limiter = RateLimiter()
+  user = (('user', 1, 1), (5, 10.0))
+  guild = (('guild', 1, 0), (1, 10.0))
+  assert limiter.acquire([user, guild]) == 0
+  assert limiter.acquire([user, guild]) == pytest.approx(10.0)
+  # The rejected send didn't spend from the user's bucket
+  assert limiter.buckets[user[0]][0] == pytest.approx(4.0)
+
+
+def test_ratelimit_prunes_every_refilled_bucket(clock:list[float]):
+  limiter = RateLimiter()
+  slow = (('user', 1, 1), (1, 600.0))
+  fast = (('user', 1, 2), (1, 1.0))
+  assert limiter.acquire([slow]) == 0
+  assert limiter.acquire([fast]) == 0
+  clock[0] += RateLimiter.PRUNE_INTERVAL
+  limiter.prune(clock[0])
+  # The fast bucket refilled behind a slow one that is still refilling
+  assert list(limiter.buckets) == [slow[0]]
+
+
+# LockRegistry
+
+def test_lock_is_exclusive():
+  async def run():
+    locks = LockRegistry()
+    async with locks.hold('a') as held:
+      assert held
+      async with locks.hold('a') as again:
+        assert not again
+      async with locks.hold('b') as other:
+        assert other
+    async with locks.hold('a') as held:
+      assert held
+    assert locks.locks == {}
+    assert (locks.acquired, locks.contended) == (3, 1)
+  asyncio.run(run())
+
+
+def test_lock_expires(clock:list[float]):
+  locks = LockRegistry(ttl=10)
+  token = locks.acquire('a')
+  assert token is not None
+  assert locks.acquire('a') is None
+  clock[0] += 10
+  newtoken = locks.acquire('a')
+  assert newtoken is not None
+  # The expired holder can't release the new holder's lock
+  locks.release('a', token)
+  assert locks.acquire('a') is None
+  locks.release('a', newtoken)
+  assert locks.locks == {}
+
+
+# InteractionRouter
+
+async def handler_a(_):
+  pass
+
+
+async def handler_b(_):
+  pass
+
+
+def test_router_longest_prefix_wins():
+  router = InteractionRouter()
+  router.register('confession', handler_a)
+  router.register('confession_vet', handler_b)
+  assert router.match('confession_vet_123') == ('confession_vet', handler_b)
+  assert router.match('confession_other') == ('confession', handler_a)
+  assert router.match('confessio') is None
+  assert router.match('other') is None
+
+
+def test_router_fallback_is_restored():
+  router = InteractionRouter()
+  router.register('pending_', handler_a, fallback=True)
+  router.register('pending_', handler_b)
+  # Registering the fallback again doesn't put it on top
+  router.register('pending_', handler_a, fallback=True)
+  assert router.match('pending_1') == ('pending_', handler_b)
+  router.unregister('pending_', handler_b)
+  assert router.match('pending_1') == ('pending_', handler_a)
+
+
+def test_router_unregister_prunes_trie():
+  router = InteractionRouter()
+  router.register('ab', handler_a)
+  router.register('abcd', handler_b)
+  router.unregister('abcd')
+  assert router.root == {'a': {'b': {'': [('ab', handler_a)]}}}
+  assert router.match('abcd') == ('ab', handler_a)
+  router.unregister('ab', handler_a)
+  assert router.root == {}
+  # Unknown prefixes are ignored
+  router.unregister('xyz')
@@ -0,0 +1,45 @@
+"""
+  Tests for confessions_filters
+  Usage: python3 -m pytest tests
+"""
+
+from extensions.confessions_filters import BadwordFilter, BadwordCache
+
+
+def test_badword_finds_words_anywhere():
+  badwords = BadwordFilter(['apple', 'banana'])
+  assert badwords.search("I like apples") == 'apple'
+  assert badwords.search("bananas!") == 'banana'
+  assert badwords.search("cherries") is None
+
+
+def test_badword_overlapping_words():
+  # 'she' is only found by following the failure link out of 'sh'
+  badwords = BadwordFilter(['he', 'she', 'hers'])
+  assert badwords.search("ushers") == 'she'
+  assert badwords.search("xhe") == 'he'
+
+
+def test_badword_ignores_case_and_lookalikes():
+  badwords = BadwordFilter(['secret'])
+  assert badwords.search("SECRET") == 'secret'
+  # Cyrillic е and с, a fullwidth t and a zero width space
+  assert badwords.search("sесre​ｔ") == 'secret'
+
+
+def test_badword_skips_blank_words():
+  badwords = BadwordFilter(['', ' ', 'word '])
+  assert badwords.search("a word") == 'word'
+  assert badwords.search("nothing here") is None
+  assert BadwordFilter([]).search("anything") is None
+
+
+def test_badword_cache_rebuilds_on_change():
+  cache = BadwordCache()
+  first = cache.get(1, 'apple,banana')
+  assert cache.get(1, 'apple,banana') is first
+  second = cache.get(1, 'cherry')
+  assert second is not first
+  assert second.search("apple") is None
+  cache.forget(1)
+  assert 1 not in cache.filters